@@ -0,0 +1,135 @@
+"""Audio worker process: decodes stations with FFmpeg, applies volume and encodes Opus.
+
+radiobot starts AUDIO_WORKERS of these as ``python audio_worker.py <read ahead>``. It is a
+separate script rather than a multiprocessing target so workers don't import the whole bot.
+Each worker runs any number of streams, one thread each, and talks to the bot over its
+stdin and stdout using multiprocessing.connection framing.
+
+Messages from the bot are pickled tuples:
+
+    ('open', stream_id, url, before_options, options, volume, normalize)
+    ('volume', stream_id, volume)
+    ('close', stream_id)
+
+Messages to the bot are raw bytes, a HEADER followed by the payload: an Opus frame for FRAME,
+nothing for END and READY, and a UTF-8 message for ERROR.
+"""
+import os
+import struct
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+
+HEADER = struct.Struct('!IB')  # stream id, message kind
+FRAME, END, ERROR, READY = range(4)
+READY_STREAM = 0xFFFFFFFF  # Stream id used for READY and for errors that concern the whole worker
+
+class WorkerStream(threading.Thread):
+    def __init__(self, worker, stream_id, url, before_options, options, volume, normalize, read_ahead):
+        super().__init__(daemon=True, name=f'audio-stream-{stream_id}')
+        self.worker = worker
+        self.stream_id = stream_id
+        self.url = url
+        self.before_options = before_options
+        self.options = options
+        self.volume = volume
+        self.normalize = normalize
+        self.read_ahead = read_ahead
+        self.closed = False
+
+    def run(self):
+        import discord
+        from gain import GainTransformer
+
+        try:
+            # Opus encoders carry state from frame to frame, so every stream needs its own
+            encoder = discord.opus.Encoder()
+            # The same gain processing as the bot's in-process PCM path, ramps and normalization included
+            source = GainTransformer(discord.FFmpegPCMAudio(self.url, before_options=self.before_options, options=self.options),
+                                     self.volume, normalize=self.normalize)
+        except Exception as e:
+            self.worker.send(self.stream_id, ERROR, str(e).encode())
+            return
+
+        try:
+            started = time.perf_counter()
+            sent = 0
+            while not self.closed:
+                if source.volume != self.volume:
+                    source.volume = self.volume  # Starts a ramp, so only set it when it changes
+                pcm = source.read()
+                if not pcm:
+                    break
+                self.worker.send(self.stream_id, FRAME, encoder.encode(pcm, encoder.SAMPLES_PER_FRAME))
+                sent += 1
+                # Live streams arrive in real time anyway, this keeps an initial burst from flooding the pipe
+                ahead = sent * discord.opus.Encoder.FRAME_LENGTH / 1000 - (time.perf_counter() - started)
+                if ahead > self.read_ahead:
+                    time.sleep(ahead - self.read_ahead)
+        except Exception as e:
+            self.worker.send(self.stream_id, ERROR, str(e).encode())
+        finally:
+            source.cleanup()
+            if not self.closed:
+                self.worker.send(self.stream_id, END)
+            self.worker.streams.pop(self.stream_id, None)
+
+class Worker:
+    def __init__(self, incoming, outgoing, read_ahead):
+        self.incoming = incoming
+        self.outgoing = outgoing
+        self.read_ahead = read_ahead
+        self.streams = {}
+        self._send_lock = threading.Lock()
+
+    def send(self, stream_id, kind, payload=b''):
+        with self._send_lock:
+            try:
+                self.outgoing.send_bytes(HEADER.pack(stream_id, kind) + payload)
+            except (BrokenPipeError, OSError):
+                pass  # The bot is gone, the main loop will notice
+
+    def serve(self):
+        import discord
+
+        try:
+            discord.opus.Encoder()  # Fail the whole worker up front if libopus can't be loaded
+        except Exception as e:
+            self.send(READY_STREAM, ERROR, f'Opus encoder unavailable: {e}'.encode())
+            return
+        self.send(READY_STREAM, READY)
+
+        while True:
+            try:
+                message = self.incoming.recv()
+            except (EOFError, OSError):
+                break
+            if message[0] == 'open':
+                stream = WorkerStream(self, *message[1:], self.read_ahead)
+                self.streams[stream.stream_id] = stream
+                stream.start()
+            elif message[0] == 'volume':
+                stream = self.streams.get(message[1])
+                if stream is not None:
+                    stream.volume = message[2]
+            elif message[0] == 'close':
+                stream = self.streams.pop(message[1], None)
+                if stream is not None:
+                    stream.closed = True
+
+        for stream in list(self.streams.values()):
+            stream.closed = True
+
+def main():
+    read_ahead = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    incoming = Connection(os.dup(0), writable=False)
+    outgoing = Connection(os.dup(1), readable=False)
+    # Keep stray output (FFmpeg, discord.py warnings) out of the frame pipe
+    os.dup2(2, 1)
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    Worker(incoming, outgoing, read_ahead).serve()
+
+if __name__ == '__main__':
+    main()
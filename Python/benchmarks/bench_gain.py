@@ -0,0 +1,63 @@
+"""Micro-benchmark: per-frame cost of GainTransformer vs discord's PCMVolumeTransformer.
+
+Run from the Python/ directory:
+
+    python benchmarks/bench_gain.py [frames]
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import discord
+import gain
+import radiobot
+
+FRAMES = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+
+class LoopSource(discord.AudioSource):
+    """Endlessly replays a handful of pre-generated noise frames"""
+    def __init__(self):
+        rng = random.Random(0)
+        self.frames = [bytes(rng.getrandbits(8) for _ in range(radiobot.FRAME_SIZE)) for _ in range(8)]
+        self.index = 0
+
+    def read(self):
+        self.index += 1
+        return self.frames[self.index % len(self.frames)]
+
+def bench(name, transformer, change_volume=False):
+    # Warm up caches and lazily created buffers
+    for _ in range(50):
+        transformer.read()
+
+    started = time.perf_counter()
+    for i in range(FRAMES):
+        if change_volume and i % VOLUME_CHANGE_EVERY == 0:
+            transformer.volume = 0.3 if transformer.volume > 0.4 else 0.6
+        transformer.read()
+    elapsed = time.perf_counter() - started
+
+    per_frame = elapsed / FRAMES * 1e6
+    budget = per_frame / (radiobot.FRAME_LENGTH * 1e6) * 100
+    print(f'{name:<42} {per_frame:8.1f} µs/frame  ({budget:.2f}% of the 20 ms frame budget)')
+
+VOLUME_CHANGE_EVERY = 25  # Keeps a ramp in progress roughly 40% of the time
+
+if __name__ == '__main__':
+    print(f'{FRAMES} frames of {radiobot.FRAME_SIZE} bytes, numpy {"available" if gain.numpy else "missing"}')
+    print()
+
+    bench('PCMVolumeTransformer (audioop.mul)', discord.PCMVolumeTransformer(LoopSource(), 0.5))
+    bench('GainTransformer steady gain', gain.GainTransformer(LoopSource(), 0.5))
+    bench('GainTransformer with ramps', gain.GainTransformer(LoopSource(), 0.5), change_volume=True)
+    bench('GainTransformer with normalization', gain.GainTransformer(LoopSource(), 0.5, normalize=True))
+
+    numpy = gain.numpy
+    gain.numpy = None
+    try:
+        bench('GainTransformer array fallback', gain.GainTransformer(LoopSource(), 0.5))
+    finally:
+        gain.numpy = numpy
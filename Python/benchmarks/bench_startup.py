@@ -0,0 +1,46 @@
+"""Startup benchmark: cost of importing the bot with lazy yt-dlp vs the old eager import.
+
+Each case runs in a fresh interpreter, the way a deploy or a restart after a crash does.
+Run from the Python/ directory:
+
+    python benchmarks/bench_startup.py [runs]
+"""
+import os
+import statistics
+import subprocess
+import sys
+
+RUNS = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+BOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# The bot used to import yt_dlp and build a YoutubeDL instance at module import time
+EAGER = "import yt_dlp, radiobot; yt_dlp.YoutubeDL(radiobot.ytdl_format_options)"
+CASES = [
+    ('lazy (import radiobot)', "import radiobot"),
+    ('eager (old behaviour)', EAGER),
+    ('first extraction worker', "import radiobot; radiobot.extraction_service._ytdl()"),
+]
+
+TIMED = """
+import time
+started = time.perf_counter()
+{code}
+print(time.perf_counter() - started)
+"""
+
+def run(code):
+    result = subprocess.run([sys.executable, '-W', 'ignore', '-c', TIMED.format(code=code)],
+                            cwd=BOT_DIR, capture_output=True, text=True, check=True)
+    return float(result.stdout.strip().splitlines()[-1])
+
+def modules_loaded(code):
+    result = subprocess.run([sys.executable, '-W', 'ignore', '-c', f"import sys\n{code}\nprint(len(sys.modules))"],
+                            cwd=BOT_DIR, capture_output=True, text=True, check=True)
+    return int(result.stdout.strip().splitlines()[-1])
+
+if __name__ == '__main__':
+    print(f'{RUNS} cold runs per case, median wall time')
+    print()
+    for name, code in CASES:
+        timings = [run(code) for _ in range(RUNS)]
+        print(f'{name:<28} {statistics.median(timings) * 1000:8.1f} ms  {modules_loaded(code):5d} modules')
@@ -0,0 +1,441 @@
+"""Offline load test: N simulated guilds playing synthetic streams through the real playback path.
+
+A local HTTP server plays generated MP3, AAC and HLS streams in real time, and a fake gateway
+hands out voice clients that run discord.py's own AudioPlayer but never touch the network.
+Every guild joins, plays one station, turns the volume down (moving off the Opus passthrough path),
+switches to another station and stops, while the harness samples
+CPU, memory, FFmpeg and audio worker processes. Needs FFmpeg on PATH (and libopus to include Opus encoding).
+Run from the Python/ directory:
+
+    python benchmarks/load_test.py [--guilds 20] [--stations 4] [--hold 10] [--jitter 300 --burst 0] [--no-shared] [--pcm] [--workers 2]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import discord
+from aiohttp import web
+
+import radiobot
+
+FORMATS = {
+    # name: (file extension, FFmpeg encoder arguments, content type)
+    'mp3': ('mp3', ['-c:a', 'libmp3lame', '-b:a', '128k', '-f', 'mp3'], 'audio/mpeg'),
+    'aac': ('aac', ['-c:a', 'aac', '-b:a', '128k', '-f', 'adts'], 'audio/aac'),
+    'hls': ('m3u8', ['-c:a', 'aac', '-b:a', '128k', '-f', 'hls', '-hls_time', '2', '-hls_list_size', '0'], None),
+}
+STREAM_BYTES_PER_SECOND = 128_000 // 8
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--guilds', type=int, default=20, help='simulated guilds (default 20)')
+    parser.add_argument('--stations', type=int, default=4, help='distinct synthetic stations (default 4)')
+    parser.add_argument('--formats', default='mp3,aac,hls', help='stream formats to cycle through (default mp3,aac,hls)')
+    parser.add_argument('--hold', type=float, default=10, help='seconds each station plays before the next step (default 10)')
+    parser.add_argument('--ramp', type=float, default=2, help='seconds over which guilds start (default 2)')
+    parser.add_argument('--jitter', type=float, default=0, help='max extra delay in ms added to each stream chunk (default 0)')
+    parser.add_argument('--burst', type=float, default=2, help='seconds of audio streams send ahead of real time (default 2)')
+    parser.add_argument('--handshake', type=float, default=0.05, help='simulated voice handshake seconds (default 0.05)')
+    parser.add_argument('--no-shared', action='store_true', help='give every guild its own FFmpeg (SHARED_BROADCAST = False)')
+    parser.add_argument('--pcm', action='store_true', help='disable Opus passthrough (OPUS_PASSTHROUGH = False)')
+    parser.add_argument('--workers', type=int, default=0, help='audio worker processes for the PCM path (AUDIO_WORKERS, default 0)')
+    parser.add_argument('--no-jitter-buffer', action='store_true', help='read FFmpeg directly (JITTER_BUFFER = False)')
+    parser.add_argument('--no-gapless', action='store_true', help='stop before switching (GAPLESS_SWITCH = False)')
+    parser.add_argument('--json', metavar='PATH', help='also write the results as JSON')
+    return parser.parse_args()
+
+# Synthetic streams
+def generate_stream(fmt, index, seconds, directory):
+    """Encode a tone (different per station) with FFmpeg, returning the file path"""
+    extension, encoder_args, _ = FORMATS[fmt]
+    path = os.path.join(directory, f'{fmt}{index}.{extension}')
+    tone = f'sine=frequency={220 + 55 * index}:sample_rate=44100:duration={seconds}'
+    subprocess.run(['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', tone, '-ac', '2', *encoder_args, path], check=True)
+    return path
+
+class StreamServer:
+    """Serves looping Icecast-style live streams and static HLS playlists on 127.0.0.1"""
+    def __init__(self, directory, jitter, burst):
+        self.directory = directory
+        self.jitter = jitter / 1000
+        self.burst = burst
+        self.live = {}  # file name -> (bytes, content type)
+        self.port = None
+        self._runner = None
+
+    def add_live(self, path, content_type):
+        with open(path, 'rb') as f:
+            self.live[os.path.basename(path)] = (f.read(), content_type)
+
+    async def handle_live(self, request):
+        data, content_type = self.live[request.match_info['name']]
+        response = web.StreamResponse(headers={'Content-Type': content_type, 'icy-name': request.match_info['name']})
+        await response.prepare(request)
+
+        # Like real Icecast servers, send a few seconds up front (--burst) and then keep pace with playback
+        chunk = STREAM_BYTES_PER_SECOND // 4
+        position = 0
+        started = time.monotonic()
+        sent = 0
+        try:
+            while True:
+                piece = data[position:position + chunk]
+                position = (position + chunk) % len(data)
+                await response.write(piece)
+                sent += len(piece)
+                ahead = sent / STREAM_BYTES_PER_SECOND - (time.monotonic() - started) - self.burst
+                delay = max(0, ahead) + random.uniform(0, self.jitter)
+                if delay:
+                    await asyncio.sleep(delay)
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        return response
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get('/live/{name}', self.handle_live)
+        app.router.add_static('/static/', self.directory)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, '127.0.0.1', 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def url(self, fmt, path):
+        name = os.path.basename(path)
+        if fmt == 'hls':
+            return f'http://127.0.0.1:{self.port}/static/{name}'
+        return f'http://127.0.0.1:{self.port}/live/{name}'
+
+# Fake gateway
+class NullEncoder:
+    """Stands in for the Opus encoder when libopus is not installed"""
+    SAMPLES_PER_FRAME = discord.opus.Encoder.SAMPLES_PER_FRAME
+
+    def encode(self, pcm, frame_size):
+        return b''
+
+def make_encoder():
+    if discord.opus.is_loaded() or discord.opus._load_default():
+        return discord.opus.Encoder()
+    return NullEncoder()
+
+class FakeVoiceWebSocket:
+    async def speak(self, state=True):
+        pass
+
+class FakeVoiceClient(discord.VoiceClient):
+    """A VoiceClient whose packets go nowhere; playback still runs in discord.py's AudioPlayer"""
+    def __init__(self, client, channel):
+        self.client = client
+        self.channel = channel
+        self.loop = client.loop
+        self._connected = threading.Event()
+        self._connected.set()
+        self._player = None
+        self.encoder = discord.utils.MISSING  # Created by play() for PCM sources, as in the real client
+        self.ws = FakeVoiceWebSocket()
+        self.packets = 0
+        self.first_audio_at = None
+        self.late_packets = 0
+        self._last_packet = None
+
+    def send_audio_packet(self, data, *, encode=True):
+        now = time.perf_counter()
+        if self.first_audio_at is None and data not in (radiobot.SILENCE_FRAME, radiobot.OPUS_SILENCE_FRAME):
+            self.first_audio_at = now
+        if encode:
+            self.encoder.encode(data, self.encoder.SAMPLES_PER_FRAME)
+        if self._last_packet is not None and now - self._last_packet > radiobot.LATE_FRAME_THRESHOLD:
+            self.late_packets += 1
+        self._last_packet = now
+        self.packets += 1
+
+    def play(self, source, *, after=None):
+        # Without libopus the real client can't create its encoder, so stand in for it
+        if not self.encoder and not source.is_opus() and not discord.opus.is_loaded():
+            self.encoder = NullEncoder()
+        super().play(source, after=after)
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self._connected.clear()
+        if self.channel.guild.voice_client is self:
+            self.channel.guild.voice_client = None
+
+class FakeVoiceChannel(discord.VoiceChannel):
+    def __init__(self, guild, channel_id, handshake):
+        self.guild = guild
+        self.id = channel_id
+        self.name = f'radio-{channel_id}'
+        self.handshake = handshake
+
+    async def connect(self, *, timeout=60.0, reconnect=True, cls=None):
+        await asyncio.sleep(self.handshake)
+        self.guild.voice_client = FakeVoiceClient(radiobot.bot, self)
+        return self.guild.voice_client
+
+class FakeGuild:
+    def __init__(self, guild_id, handshake):
+        self.id = guild_id
+        self.name = f'guild-{guild_id}'
+        self.voice_client = None
+        self.channel = FakeVoiceChannel(self, guild_id * 10, handshake)
+
+    def get_channel(self, channel_id):
+        return self.channel if channel_id == self.channel.id else None
+
+# Resource sampling
+def proc_cpu_seconds(pid):
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+def proc_rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0
+
+def child_pids(pid):
+    """Every descendant of a process: FFmpeg, and audio workers with their own FFmpeg children"""
+    pids = []
+    try:
+        for task in os.listdir(f'/proc/{pid}/task'):
+            with open(f'/proc/{pid}/task/{task}/children') as f:
+                pids.extend(int(child) for child in f.read().split())
+    except OSError:
+        return pids
+    for child in list(pids):
+        pids.extend(child_pids(child))
+    return pids
+
+def proc_name(pid):
+    with open(f'/proc/{pid}/comm') as f:
+        return f.read().strip()
+
+class ResourceSampler:
+    """Samples the bot process and its child processes once a second"""
+    def __init__(self):
+        self.child_cpu = {}  # pid -> last CPU seconds seen (kept after the process exits)
+        self.peak_ffmpeg = 0
+        self.peak_workers = 0
+        self.peak_rss = 0
+        self.peak_child_rss = 0
+        self.peak_jitter_target = 0
+        self.stream_seconds = 0  # Integral of playing voice clients over time
+        self._task = None
+
+    async def run(self, guilds):
+        while True:
+            ffmpeg = workers = 0
+            child_rss = 0
+            for pid in child_pids(os.getpid()):
+                try:
+                    self.child_cpu[pid] = proc_cpu_seconds(pid)
+                    child_rss += proc_rss_mb(pid)
+                    if proc_name(pid) == 'ffmpeg':
+                        ffmpeg += 1
+                    else:
+                        workers += 1
+                except OSError:
+                    pass
+            self.peak_ffmpeg = max(self.peak_ffmpeg, ffmpeg)
+            self.peak_workers = max(self.peak_workers, workers)
+            self.peak_child_rss = max(self.peak_child_rss, child_rss)
+            self.peak_rss = max(self.peak_rss, proc_rss_mb(os.getpid()))
+            self.peak_jitter_target = max([self.peak_jitter_target, *radiobot.metric_jitter_buffer_target.samples().values()])
+            self.stream_seconds += sum(1 for guild in guilds if guild.voice_client and guild.voice_client.is_playing())
+            await asyncio.sleep(1)
+
+    def start(self, guilds):
+        self._task = asyncio.ensure_future(self.run(guilds))
+
+    def stop(self):
+        self._task.cancel()
+
+# Guild scripts
+async def run_guild(guild, first, second, hold, delay, results):
+    await asyncio.sleep(delay)
+    player = radiobot.players.get(guild.id)
+    player.channel_id = guild.channel.id
+
+    connect_started = time.monotonic()
+    await player.connection.connect(guild.channel)
+    results['connect'].append(time.monotonic() - connect_started)
+
+    requested = time.perf_counter()
+    try:
+        await radiobot.start_playback(player, first, owner=guild.id)
+    except Exception as e:
+        results['errors'].append(f'{guild.name} {first}: {e}')
+        return
+    # Cold starts are done when the first real audio packet leaves the voice client
+    while guild.voice_client.first_audio_at is None and time.perf_counter() - requested < radiobot.SWITCH_PREBUFFER_TIMEOUT:
+        await asyncio.sleep(0.01)
+    if guild.voice_client.first_audio_at is not None:
+        results['ttfa'].append(guild.voice_client.first_audio_at - requested)
+    else:
+        results['errors'].append(f'{guild.name} {first}: no audio')
+
+    # Any volume but the default moves an Opus passthrough station onto a PCM path mid-stream
+    await asyncio.sleep(hold)
+    listener = types.SimpleNamespace(voice=types.SimpleNamespace(channel=guild.channel))
+    volume_started = time.perf_counter()
+    reply = await radiobot.set_volume(player, listener, 25)
+    results['volume'].append(time.perf_counter() - volume_started)
+    if isinstance(reply, radiobot.ErrorReply) or "didn't start" in reply:
+        results['errors'].append(f'{guild.name} volume: {reply}')
+
+    await asyncio.sleep(hold)
+    try:
+        await radiobot.start_playback(player, second, owner=guild.id)
+        results['switch'].append(player.last_switch_latency)
+    except Exception as e:
+        results['errors'].append(f'{guild.name} {second}: {e}')
+
+    await asyncio.sleep(hold)
+    results['packets'] += guild.voice_client.packets
+    results['late_packets'] += guild.voice_client.late_packets
+    player.supervisor.cancel()
+    guild.voice_client.stop()
+    await player.connection.disconnect()
+
+def summarize(values):
+    if not values:
+        return 'n/a'
+    values = sorted(values)
+    p95 = values[min(len(values) - 1, int(len(values) * 0.95))]
+    return f'p50 {statistics.median(values) * 1000:7.0f} ms · p95 {p95 * 1000:7.0f} ms · max {values[-1] * 1000:7.0f} ms'
+
+async def main(args):
+    radiobot.SHARED_BROADCAST = not args.no_shared
+    radiobot.OPUS_PASSTHROUGH = not args.pcm
+    radiobot.GAPLESS_SWITCH = not args.no_gapless
+    radiobot.JITTER_BUFFER = not args.no_jitter_buffer
+    radiobot.AUTO_RECOVER = False  # Streams that end are a harness bug, not something to paper over
+    radiobot.audio_workers.size = args.workers
+
+    loop = asyncio.get_running_loop()
+    radiobot.bot.loop = loop
+    guilds = {guild_id: FakeGuild(guild_id, args.handshake) for guild_id in range(1, args.guilds + 1)}
+    radiobot.bot.get_guild = guilds.get
+
+    workdir = tempfile.mkdtemp(prefix='radiobot-load-')
+    server = StreamServer(workdir, args.jitter, args.burst)
+    formats = args.formats.split(',')
+    print(f'Generating {args.stations} synthetic stations ({", ".join(formats)})...')
+    stations = []
+    seconds = int(args.hold * 3 + 30)
+    for index in range(args.stations):
+        fmt = formats[index % len(formats)]
+        path = await loop.run_in_executor(None, generate_stream, fmt, index, seconds, workdir)
+        if FORMATS[fmt][2]:
+            server.add_live(path, FORMATS[fmt][2])
+        stations.append((f'load{fmt}{index}', fmt, path))
+    await server.start()
+
+    catalog_path = os.path.join(workdir, 'stations.json')
+    with open(catalog_path, 'w') as f:
+        json.dump({'stations': [{'name': name, 'title': f'Synthetic {fmt.upper()} {name}', 'url': server.url(fmt, path),
+                                 'region': 'global', 'codec': fmt} for name, fmt, path in stations]}, f)
+    radiobot.catalog.path = catalog_path
+    radiobot.catalog.load()
+    await loop.run_in_executor(None, radiobot.audio_workers.start)
+
+    encoder = make_encoder()
+    print(f'{args.guilds} guilds · shared broadcast {"on" if radiobot.SHARED_BROADCAST else "off"} · '
+          f'Opus passthrough {"on" if radiobot.OPUS_PASSTHROUGH else "off"} · gapless {"on" if radiobot.GAPLESS_SWITCH else "off"} · '
+          f'jitter buffer {"on" if radiobot.JITTER_BUFFER else "off"} · {len(radiobot.audio_workers.workers)} audio workers · '
+          f'{"Opus encoding" if isinstance(encoder, discord.opus.Encoder) else "no libopus, Opus encoding skipped"}')
+    print()
+
+    results = {'connect': [], 'ttfa': [], 'volume': [], 'switch': [], 'errors': [], 'packets': 0, 'late_packets': 0}
+    sampler = ResourceSampler()
+    sampler.start(guilds.values())
+    cpu_started = time.process_time()
+    wall_started = time.monotonic()
+
+    await asyncio.gather(*(
+        run_guild(guild, stations[i % len(stations)][0], stations[(i + 1) % len(stations)][0],
+                  args.hold, args.ramp * i / len(guilds), results)
+        for i, guild in enumerate(guilds.values())))
+
+    wall = time.monotonic() - wall_started
+    bot_cpu = time.process_time() - cpu_started
+    sampler.stop()
+    radiobot.audio_workers.stop()
+    await server.stop()
+
+    child_cpu = sum(sampler.child_cpu.values())
+    stream_seconds = max(1, sampler.stream_seconds)
+    report = {
+        'guilds': args.guilds,
+        'stations': args.stations,
+        'shared_broadcast': radiobot.SHARED_BROADCAST,
+        'opus_passthrough': radiobot.OPUS_PASSTHROUGH,
+        'gapless': radiobot.GAPLESS_SWITCH,
+        'connect': results['connect'],
+        'time_to_first_audio': results['ttfa'],
+        'volume_change': results['volume'],
+        'switch_latency': results['switch'],
+        'ffmpeg_spawned': radiobot.metric_ffmpeg_spawned.total(),
+        'ffmpeg_peak': sampler.peak_ffmpeg,
+        'audio_workers': sampler.peak_workers,
+        'bot_cpu_percent': bot_cpu / wall * 100,
+        'child_cpu_percent': child_cpu / wall * 100,
+        'cpu_ms_per_stream_second': (bot_cpu + child_cpu) / stream_seconds * 1000,
+        'bot_rss_mb': sampler.peak_rss,
+        'child_rss_mb': sampler.peak_child_rss,
+        'packets': results['packets'],
+        'late_packets': results['late_packets'],
+        'late_frames': radiobot.metric_late_frames.total(),
+        'underruns': radiobot.metric_frame_underruns.total(),
+        'jitter_buffer': radiobot.JITTER_BUFFER,
+        'jitter_rebuffers': radiobot.metric_jitter_buffer_rebuffers.total(),
+        'jitter_dropped_frames': radiobot.metric_jitter_buffer_dropped.total(),
+        'jitter_peak_target': sampler.peak_jitter_target,
+        'errors': results['errors'],
+    }
+
+    print(f'{"Voice connect":<22} {summarize(results["connect"])}')
+    print(f'{"Time to first audio":<22} {summarize(results["ttfa"])}')
+    print(f'{"Volume change":<22} {summarize(results["volume"])}')
+    print(f'{"Switch latency":<22} {summarize(results["switch"])}')
+    print(f'{"FFmpeg processes":<22} {report["ffmpeg_peak"]} peak · {report["ffmpeg_spawned"]} started in the bot process')
+    print(f'{"CPU":<22} bot {report["bot_cpu_percent"]:.1f}% · children {report["child_cpu_percent"]:.1f}% of one core · '
+          f'{report["cpu_ms_per_stream_second"]:.1f} ms per stream-second')
+    print(f'{"Memory":<22} bot {report["bot_rss_mb"]:.0f} MB · children {report["child_rss_mb"]:.0f} MB peak')
+    print(f'{"Frames":<22} {report["late_frames"]} late reads · {report["underruns"]} underruns · '
+          f'{report["late_packets"]} of {report["packets"]} packets late')
+    if radiobot.JITTER_BUFFER:
+        print(f'{"Jitter buffers":<22} {report["jitter_peak_target"]} frame peak target · {report["jitter_rebuffers"]} rebuffers · '
+              f'{report["jitter_dropped_frames"]} frames dropped')
+    for error in results['errors']:
+        print(f'❌ {error}')
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,133 @@
+"""Volume and loudness processing for 16-bit stereo PCM.
+
+Shared by radiobot's in-process PCM path and the audio worker processes, so a station sounds
+the same whichever of them plays it. Only needs discord.py, so workers can import it without
+loading the bot.
+"""
+import math
+import sys
+from array import array
+
+import discord
+
+try:
+    import numpy
+except ImportError:  # Fall back to the array module for gain processing
+    numpy = None
+
+VOLUME_RAMP_FRAMES = 10  # 20 ms frames a volume change is spread over (200 ms)
+LOUDNESS_TARGET_RMS = 3000  # Target RMS level (16-bit samples) when normalizing
+LOUDNESS_MAX_GAIN = 4.0  # Normalization never boosts or cuts by more than this factor
+
+class GainTransformer(discord.AudioSource):
+    """Applies volume to 16-bit stereo PCM with click-free ramps and optional loudness normalization.
+
+    Frames are processed with NumPy when it is installed and with the array module otherwise,
+    so this works on Python builds without audioop.
+    """
+    def __init__(self, original, volume=1.0, *, normalize=False):
+        if not isinstance(original, discord.AudioSource):
+            raise TypeError(f'expected AudioSource not {original.__class__.__name__}.')
+        
+        if original.is_opus():
+            raise discord.ClientException('AudioSource must not be Opus encoded.')
+        
+        self.original = original
+        self.normalize = normalize
+        self._volume = max(volume, 0.0)
+        self._gain = self._volume  # Gain applied at the end of the previous frame
+        self._ramp_left = 0  # Frames left in the current volume ramp
+        self._mean_square = None  # Running loudness estimate for normalization
+
+    @property
+    def volume(self):
+        """The target volume as a floating point percentage (e.g. ``1.0`` for 100%)"""
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._volume = max(value, 0.0)
+        self._ramp_left = VOLUME_RAMP_FRAMES
+
+    @property
+    def loudness_gain(self):
+        """Extra gain currently applied by loudness normalization"""
+        if not self.normalize or not self._mean_square:
+            return 1.0
+        gain = LOUDNESS_TARGET_RMS / (self._mean_square ** 0.5)
+        return min(max(gain, 1 / LOUDNESS_MAX_GAIN), LOUDNESS_MAX_GAIN)
+
+    def cleanup(self):
+        self.original.cleanup()
+
+    def read(self):
+        frame = self.original.read()
+        if len(frame) < 4 or len(frame) % 2:
+            return frame
+        
+        if numpy is not None:
+            samples = numpy.frombuffer(frame, dtype='<i2')
+        else:
+            samples = array('h', frame)
+            if sys.byteorder == 'big':
+                samples.byteswap()
+        
+        if self.normalize:
+            self._track_loudness(samples)
+        
+        start = self._gain
+        target = min(self._volume, 2.0) * self.loudness_gain
+        if self._ramp_left > 0:
+            end = start + (target - start) / self._ramp_left
+            self._ramp_left -= 1
+        else:
+            end = target
+        self._gain = end
+        
+        if start == end == 1.0:
+            return frame
+        
+        if numpy is not None:
+            return self._apply_numpy(samples, start, end)
+        return self._apply_array(samples, start, end)
+
+    def _track_loudness(self, samples):
+        if numpy is not None:
+            mean_square = float(numpy.dot(samples, samples.astype(numpy.float64))) / len(samples)
+        else:
+            mean_square = sum(sample * sample for sample in samples) / len(samples)
+        
+        if mean_square < 100 ** 2:
+            return  # Don't let silence between programmes pump the gain up
+        
+        if self._mean_square is None:
+            self._mean_square = mean_square
+        else:
+            # Roughly a 3 second window at 50 frames a second
+            self._mean_square += (mean_square - self._mean_square) * 0.0067
+
+    @staticmethod
+    def _apply_numpy(samples, start, end):
+        # Doubles and flooring, like audioop.mul, so a steady gain gives identical output
+        scaled = samples.astype(numpy.float64)
+        if start == end:
+            scaled *= start
+        else:
+            # One gain step per stereo sample pair, ramping linearly across the frame
+            ramp = numpy.linspace(start, end, (len(samples) + 1) // 2, endpoint=False)
+            scaled *= numpy.repeat(ramp, 2)[:len(samples)]
+        numpy.clip(scaled, -32768, 32767, out=scaled)
+        numpy.floor(scaled, out=scaled)
+        return scaled.astype('<i2').tobytes()
+
+    @staticmethod
+    def _apply_array(samples, start, end):
+        count = len(samples)
+        step = (end - start) / (count // 2 or 1)
+        out = array('h', bytes(2 * count))
+        for i in range(count):
+            value = math.floor(samples[i] * (start + step * (i // 2)))
+            out[i] = 32767 if value > 32767 else -32768 if value < -32768 else value
+        if sys.byteorder == 'big':
+            out.byteswap()
+        return out.tobytes()
@@ -1,451 +1,2954 @@
 import discord
-from discord.ext import commands
+from discord import app_commands
+from discord.ext import commands, tasks
 import asyncio
-import yt_dlp
+import aiohttp
+import bisect
+import concurrent.futures
+import json
 import logging
+import math
+import os
+import random
+import re
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+import weakref
+from aiohttp import web
+from http.client import HTTPException
+from array import array
+from collections import deque, namedtuple
+from multiprocessing.connection import Connection
+from urllib.parse import urlsplit
+
+import audio_worker
+from gain import GainTransformer
+
+try:
+    import numpy
+except ImportError:  # Fall back to the array module for crossfade mixing
+    numpy = None
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 
-# Bot configuration
-intents = discord.Intents.default()
-intents.message_content = True
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Bot configuration
+PREFIX_COMMANDS = True  # Set to False to rely on slash commands and drop the message content intent
+SLASH_COMMANDS = True  # Register /play, /stop, /volume, /stations and /status
+intents = discord.Intents.default()
+intents.message_content = PREFIX_COMMANDS
+bot = commands.Bot(command_prefix='!' if PREFIX_COMMANDS else commands.when_mentioned, intents=intents)
+
+# Configuration - Set your specific channel and guild IDs
+TARGET_GUILD_ID = None  # Replace with your server ID (right-click server -> Copy ID)
+TARGET_CHANNEL_ID = None  # Replace with your voice channel ID (right-click channel -> Copy ID)
+AUTO_JOIN_ON_STARTUP = True  # Set to True to auto-join on bot start
+DEFAULT_VOLUME = 0.5  # Starting volume for every guild (0.0 - 1.0)
+
+# Stream cache - resolved stream URLs are reused so repeat plays skip extraction
+STREAM_CACHE_TTL = 10 * 60  # Seconds a resolved stream URL is trusted
+STREAM_CACHE_REFRESH_MARGIN = 2 * 60  # Re-resolve in the background this long before expiry
+STREAM_CACHE_FAIL_WINDOW = 5  # Playback ending within this many seconds evicts the cached URL
+
+# Extraction workers - yt-dlp runs on its own pool so it can't starve the rest of the bot
+EXTRACT_WORKERS = 4  # Parallel yt-dlp extractions (each worker owns a YoutubeDL instance)
+EXTRACT_TIMEOUT = 30  # Seconds before a caller gives up waiting on an extraction
+
+# Shared broadcasts - each station is decoded once and fanned out to every guild listening to it
+SHARED_BROADCAST = True  # Set to False to give every voice client its own FFmpeg process
+BROADCAST_BUFFER_FRAMES = 50  # 20 ms frames each listener may fall behind before dropping audio (1 s)
+
+# Jitter buffer - a reader thread keeps FFmpeg's output queued ahead of playback, as deep as the stream's jitter needs
+JITTER_BUFFER = True  # Set to False to read FFmpeg's pipe directly when a frame is due
+JITTER_BUFFER_INITIAL_FRAMES = 15  # 20 ms frames targeted before any jitter has been measured (300 ms)
+JITTER_BUFFER_MIN_FRAMES = 5  # Smallest target depth (100 ms)
+JITTER_BUFFER_MAX_FRAMES = 150  # Largest target depth (3 s), also how far the reader may get ahead
+JITTER_BUFFER_HEADROOM = 1.5  # Target depth as a multiple of the latest a frame arrived in the window
+JITTER_BUFFER_WINDOW = 30  # Seconds of arrival history the target follows, so it shrinks again after calm periods
+JITTER_BUFFER_DROP_INTERVAL = 50  # Above twice the target, one frame in this many is dropped to win latency back
+
+# Opus passthrough - let FFmpeg encode Opus and skip Python-side PCM scaling and encoding
+OPUS_PASSTHROUGH = True  # Used while a guild's volume is at DEFAULT_VOLUME, PCM is used otherwise
+OPUS_BITRATE = 128  # kbps for FFmpeg's Opus encoder
+
+# Audio workers - decoding, volume and Opus encoding for the PCM path run in separate processes
+AUDIO_WORKERS = 0  # Worker processes (e.g. one per spare core), 0 keeps the PCM path in the bot process
+WORKER_READ_AHEAD = 1.0  # Seconds of encoded audio a worker may get ahead of playback
+WORKER_BUFFER_FRAMES = 100  # Frames buffered per stream in the bot process before the oldest are dropped (2 s)
+
+# Gain processing - volume changes ramp smoothly instead of jumping (ramp and loudness levels are in gain.py)
+LOUDNESS_NORMALIZATION = False  # Set to True to even out loudness differences between stations
+
+# Playback supervisor - restarts dropped streams, trying mirrors with jittered exponential backoff
+AUTO_RECOVER = True  # Set to False to leave a dropped stream silent until the next !play
+RECOVER_MAX_ATTEMPTS = 6  # Consecutive failed rounds (station plus mirrors) before giving up
+RECOVER_BASE_DELAY = 1  # Seconds before the second round, doubled for every round after it
+RECOVER_MAX_DELAY = 30  # Upper bound on the backoff between rounds
+RECOVER_STABLE_AFTER = 30  # Seconds a restarted stream must play before the failure count resets
+
+# Gapless switching - the next station is buffered while the current one keeps playing
+GAPLESS_SWITCH = True  # Set to False to stop the old station before loading the new one
+SWITCH_PREBUFFER_FRAMES = 25  # 20 ms frames buffered before the swap (500 ms)
+SWITCH_PREBUFFER_TIMEOUT = 10  # Seconds to wait for the new stream to produce audio
+SWITCH_CROSSFADE_FRAMES = 15  # Crossfade length in frames (300 ms), 0 to cut straight over
+
+# Persisted state - designated channels, stations, volumes and resolved stream URLs survive restarts
+STATE_DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'radiobot_state.db')  # None to keep state in memory only
+RESUME_ON_STARTUP = True  # Rejoin and restart every guild's station when the bot comes back up
+
+# Voice connections - one state machine per guild so joins, moves and rejoins never race
+VOICE_CONNECT_TIMEOUT = 15  # Seconds to wait for a voice handshake
+VOICE_CONNECT_ATTEMPTS = 4  # Handshake attempts before a connect gives up
+VOICE_RECONNECT_BASE_DELAY = 2  # Seconds before the second attempt, doubled for every attempt after it
+VOICE_RECONNECT_MAX_DELAY = 60  # Upper bound on the backoff between attempts
+VOICE_REJOIN_DELAY = 2  # Seconds to let a dropped connection settle before rejoining
+
+# Metrics - Prometheus text format on a local HTTP endpoint, summarized by !metrics
+METRICS_HOST = '127.0.0.1'  # Interface the metrics endpoint listens on
+METRICS_PORT = 9108  # Port for http://METRICS_HOST:METRICS_PORT/metrics, 0 to disable
+LATE_FRAME_THRESHOLD = 0.030  # Seconds between reads of a source before a frame counts as late
+
+# Command responses - status updates share one edited message and stay inside Discord's rate limits
+RESPONSE_EDIT_INTERVAL = 1.0  # Minimum seconds between edits of a command's status message
+CHANNEL_MESSAGE_BUDGET = 5  # Messages sent or edited per channel per window (Discord allows about 5 every 5 s)
+CHANNEL_BUDGET_WINDOW = 5  # Seconds the per-channel budget is counted over
+ERROR_REPLY_WINDOW = 30  # Seconds an identical error reply to the same user in the same channel is suppressed
+ERROR_REPLY_RESERVE = 2  # Error replies are dropped instead of queued once a channel has this little budget left
+
+# Direct streams - URLs FFmpeg can open itself skip yt-dlp entirely (it is only imported when needed)
+DIRECT_STREAM_EXTENSIONS = ('.mp3', '.aac', '.ogg', '.opus', '.flac', '.m4a', '.m3u8', '.mpd')
+DIRECT_STREAM_RETRY_AFTER = 30 * 60  # Seconds a station whose direct stream failed goes through yt-dlp before trying direct again
+EXTRACT_ONLY_HOSTS = ('tunein.com', 'youtube.com', 'youtu.be', 'soundcloud.com', 'twitch.tv', 'mixcloud.com')
+
+# Stream metadata - read the current track from Icecast/SHOUTcast streams while they play
+ICY_METADATA = True  # Pull HTTP streams that carry in-band StreamTitle metadata ourselves and pipe them to FFmpeg
+ICY_CONNECT_TIMEOUT = 10  # Seconds to wait for a stream server to answer
+ICY_RETRY_AFTER = 10 * 60  # Seconds a station whose server didn't answer is left to FFmpeg before trying again
+ICY_RECONNECT_ATTEMPTS = 5  # Times a dropped stream is reopened before the playback supervisor takes over
+ICY_RECONNECT_DELAY_MAX = 5  # Longest wait between reconnects, doubling from 1 second (like FFmpeg's -reconnect_delay_max)
+
+# Station health checks - resolve the whole catalog to pre-warm the cache and flag dead entries
+PROBE_ON_STARTUP = True  # Set to False to skip the startup/periodic station probe
+PROBE_INTERVAL = 30 * 60  # Seconds between catalog health checks
+PROBE_CONCURRENCY = 4  # Stations resolved in parallel
+PROBE_TIMEOUT = 20  # Seconds before a station is considered unreachable
+
+# Radio stations database - add stations to stations.json (or a SQLite file), no restart needed
+STATION_CATALOG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stations.json')
+CATALOG_RELOAD_INTERVAL = 10  # Seconds between checks for changes to the catalog file
+STATION_REGIONS = {
+    'global': '🌍 Global/International',
+    'us': '🇺🇸 United States',
+    'europe': '🇪🇺 Europe',
+    'india': '🇮🇳 India',
+}
+
+# YTDL options for radio streaming
+ytdl_format_options = {
+    'format': 'bestaudio/best',
+    'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
+    'restrictfilenames': True,
+    'noplaylist': True,
+    'nocheckcertificate': True,
+    'ignoreerrors': False,
+    'logtostderr': False,
+    'quiet': True,
+    'no_warnings': True,
+    'default_search': 'auto',
+    'source_address': '0.0.0.0'
+}
+
+ffmpeg_options = {
+    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
+    'options': '-vn'
+}
+
+class Metric:
+    """One Prometheus metric family; label values are passed as keyword arguments"""
+    def __init__(self, kind, name, help, buckets=None):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._values = {}  # sorted label items -> value, or [bucket counts, sum, count] for histograms
+        self._lock = threading.Lock()  # Updated from voice and worker threads
+        self._collect = None
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[tuple(sorted(labels.items()))] = value
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def collect_with(self, collect):
+        """Compute this gauge at scrape time from ``collect()``, which returns ``{label items: value}``"""
+        self._collect = collect
+
+    def samples(self):
+        if self._collect is not None:
+            return dict(self._collect())
+        with self._lock:
+            return {key: ([list(value[0]), value[1], value[2]] if self.kind == 'histogram' else value)
+                    for key, value in self._values.items()}
+
+    def total(self):
+        """Sum of a counter or gauge across all labels, or the observation count of a histogram"""
+        samples = self.samples().values()
+        if self.kind == 'histogram':
+            return sum(entry[2] for entry in samples)
+        return sum(samples)
+
+    def quantile(self, q):
+        """Estimate a quantile of a histogram across all labels from its bucket bounds"""
+        entries = list(self.samples().values())
+        count = sum(entry[2] for entry in entries)
+        if not count:
+            return None
+        for i, bound in enumerate(self.buckets):
+            if sum(entry[0][i] for entry in entries) >= q * count:
+                return bound
+        return float('inf')
+
+    def mean(self):
+        entries = list(self.samples().values())
+        count = sum(entry[2] for entry in entries)
+        return sum(entry[1] for entry in entries) / count if count else None
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        for key, value in sorted(self.samples().items()):
+            if self.kind == 'histogram':
+                counts, total, count = value
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f'{self.name}_bucket{_format_labels(key + (("le", bound),))} {bucket_count}')
+                lines.append(f'{self.name}_bucket{_format_labels(key + (("le", "+Inf"),))} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(key)} {total}')
+                lines.append(f'{self.name}_count{_format_labels(key)} {count}')
+            else:
+                lines.append(f'{self.name}{_format_labels(key)} {value}')
+        return '\n'.join(lines)
+
+def _format_labels(items):
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + '}'
+
+class MetricsRegistry:
+    """Creates metrics and renders them all in the Prometheus text exposition format"""
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help):
+        return self._add(Metric('counter', name, help))
+
+    def gauge(self, name, help):
+        return self._add(Metric('gauge', name, help))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._add(Metric('histogram', name, help, buckets))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+metrics = MetricsRegistry()
+metric_extraction_seconds = metrics.histogram('radiobot_extraction_seconds', 'Time a yt-dlp worker spent extracting a URL')
+metric_resolve_seconds = metrics.histogram('radiobot_resolve_seconds', 'YTDLSource.from_url latency, by stream cache result (hit, miss, direct)')
+metric_time_to_first_audio = metrics.histogram('radiobot_time_to_first_audio_seconds', 'Time from a play request until its first audio frame')
+metric_ffmpeg_spawned = metrics.counter('radiobot_ffmpeg_spawned_total', 'FFmpeg processes started, by audio path')
+metric_ffmpeg_processes = metrics.gauge('radiobot_ffmpeg_processes', 'FFmpeg processes currently running')
+metric_stream_restarts = metrics.counter('radiobot_stream_restarts_total', 'Streams restarted by the playback supervisor')
+metric_active_streams = metrics.gauge('radiobot_active_streams', 'Streams playing, by guild')
+metric_broadcast_listeners = metrics.gauge('radiobot_broadcast_listeners', 'Voice clients subscribed to each shared broadcast')
+metric_frame_underruns = metrics.counter('radiobot_frame_underruns_total', 'Frames served as silence because no audio was buffered')
+metric_late_frames = metrics.counter('radiobot_late_frames_total', 'Frames read later than LATE_FRAME_THRESHOLD after the previous one')
+metric_command_seconds = metrics.histogram('radiobot_command_seconds', 'Command handling latency, by command')
+metric_voice_connects = metrics.counter('radiobot_voice_connects_total', 'Voice connection attempts, by outcome (connected, moved, failed)')
+metric_worker_streams = metrics.gauge('radiobot_audio_worker_streams', 'Streams running on each audio worker process')
+metric_worker_restarts = metrics.counter('radiobot_audio_worker_restarts_total', 'Audio worker processes replaced after exiting')
+metric_responses = metrics.counter('radiobot_responses_total', 'Command replies, by outcome (sent, edited, coalesced, suppressed)')
+metric_jitter_buffer_frames = metrics.gauge('radiobot_jitter_buffer_frames', 'Frames queued in jitter buffers, lowest per station and path')
+metric_jitter_buffer_target = metrics.gauge('radiobot_jitter_buffer_target_frames', 'Adaptive jitter buffer target depth, highest per station and path')
+metric_jitter_buffer_rebuffers = metrics.counter('radiobot_jitter_buffer_rebuffers_total', 'Times a jitter buffer ran dry and refilled to its target before resuming')
+metric_jitter_buffer_dropped = metrics.counter('radiobot_jitter_buffer_dropped_frames_total', 'Frames dropped to bring an overfull jitter buffer back to its target')
+
+live_ffmpeg_sources = weakref.WeakSet()  # FFmpegAudio sources whose processes may still be running
+metric_ffmpeg_processes.collect_with(lambda: {(): sum(
+    1 for source in list(live_ffmpeg_sources)
+    if getattr(source, '_process', None) and source._process.poll() is None)})
+
+live_jitter_buffers = weakref.WeakSet()
+
+def _collect_jitter_buffers(value, pick):
+    samples = {}
+    for buffer in list(live_jitter_buffers):
+        key = (('path', buffer.path), ('station', buffer.station))
+        samples[key] = pick(samples[key], value(buffer)) if key in samples else value(buffer)
+    return samples
+
+metric_jitter_buffer_frames.collect_with(lambda: _collect_jitter_buffers(lambda buffer: buffer.fill, min))
+metric_jitter_buffer_target.collect_with(lambda: _collect_jitter_buffers(lambda buffer: buffer.target, max))
+
+class FrameMonitor:
+    """Counts late frames for one source and reports when its first real audio frame is read"""
+    def __init__(self, station):
+        self.station = station or 'unknown'
+        self._last_read = None
+        self._first_audio_started = None  # Play request time, until the first frame is observed
+
+    def expect_first_audio(self, started):
+        self._first_audio_started = started
+
+    def tick(self, frame):
+        now = time.perf_counter()
+        last, self._last_read = self._last_read, now
+        # Gaps over a second are pauses or reconnects rather than a struggling send loop
+        if last is not None and LATE_FRAME_THRESHOLD < now - last < 1:
+            metric_late_frames.inc(station=self.station)
+        
+        # Compared by value: gain and crossfades hand on silence as new bytes objects
+        if self._first_audio_started is not None and frame and frame != SILENCE_FRAME and frame != OPUS_SILENCE_FRAME:
+            metric_time_to_first_audio.observe(time.monotonic() - self._first_audio_started, path='cold')
+            self._first_audio_started = None
+
+Station = namedtuple('Station', 'key name title url region codec bitrate mirrors direct')
+
+def normalize_station_name(text):
+    """Lowercase and strip everything but letters and digits, so 'Red FM' matches 'redFM'"""
+    return re.sub(r'[^0-9a-z]', '', text.lower())
+
+def _trigrams(text):
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class StationCatalog:
+    """Station catalog loaded from JSON or SQLite, with indexes for exact, prefix and fuzzy lookup"""
+    def __init__(self, path):
+        self.path = path
+        self._mtime = None
+        self._stations = {}  # normalized key -> Station, in catalog order
+        self._sorted_names = []  # (normalized name or title, key), sorted for prefix search
+        self._exact = {}  # normalized name or title -> key, names winning over titles
+        self._terms = []  # (key, trigram count) per indexed name/title
+        self._trigram_index = {}  # trigram -> ids into _terms
+
+    def __len__(self):
+        return len(self._stations)
+
+    def __iter__(self):
+        return iter(list(self._stations.values()))
+
+    def __contains__(self, key):
+        return key in self._stations
+
+    def get(self, key):
+        return self._stations.get(key)
+
+    def urls(self):
+        return {station.key: station.url for station in self._stations.values()}
+
+    def load(self):
+        """(Re)load the catalog file and rebuild the indexes, keeping the old catalog on errors"""
+        mtime = os.path.getmtime(self.path)
+        if self.path.endswith(('.db', '.sqlite', '.sqlite3')):
+            stations = self._read_sqlite()
+        else:
+            stations = self._read_json()
+        
+        by_key = {}
+        for station in stations:
+            if station.key in by_key:
+                print(f'⚠️ Duplicate station {station.name!r} in catalog, keeping the first one')
+                continue
+            by_key[station.key] = station
+        
+        sorted_names = []
+        exact = {key: key for key in by_key}
+        terms = []
+        trigram_index = {}
+        for station in by_key.values():
+            for term in {station.key, normalize_station_name(station.title or '')} - {''}:
+                sorted_names.append((term, station.key))
+                exact.setdefault(term, station.key)
+                trigrams = _trigrams(term)
+                for trigram in trigrams:
+                    trigram_index.setdefault(trigram, []).append(len(terms))
+                terms.append((station.key, len(trigrams)))
+        sorted_names.sort()
+        
+        # Swap everything in at once so lookups never see a half-built index
+        self._stations, self._sorted_names, self._exact = by_key, sorted_names, exact
+        self._terms, self._trigram_index = terms, trigram_index
+        self._mtime = mtime
+        print(f'📻 Loaded {len(by_key)} stations from {os.path.basename(self.path)}')
+
+    def reload_if_changed(self):
+        """Reload if the catalog file changed on disk, returning True if it was reloaded"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError as e:
+            print(f'❌ Could not check station catalog: {e}')
+            return False
+        if mtime == self._mtime:
+            return False
+        
+        try:
+            self.load()
+            return True
+        except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+            print(f'❌ Could not reload station catalog: {e}')
+            self._mtime = mtime  # Don't retry until the file changes again
+            return False
+
+    def _read_json(self):
+        with open(self.path, encoding='utf-8') as f:
+            entries = json.load(f)['stations']
+        return [self._make_station(entry) for entry in entries]
+
+    def _read_sqlite(self):
+        connection = sqlite3.connect(self.path)
+        try:
+            connection.row_factory = sqlite3.Row
+            columns = {row[1] for row in connection.execute('PRAGMA table_info(stations)')}
+            direct = 'direct' if 'direct' in columns else 'NULL AS direct'
+            rows = connection.execute(f'SELECT name, title, url, region, codec, bitrate, mirrors, {direct} FROM stations').fetchall()
+        finally:
+            connection.close()
+        # Mirrors are stored as a comma-separated list of station names
+        return [self._make_station(dict(row, mirrors=[m for m in (row['mirrors'] or '').split(',') if m.strip()],
+                                        direct=None if row['direct'] is None else bool(row['direct'])))
+                for row in rows]
+
+    @staticmethod
+    def _make_station(entry):
+        return Station(
+            key=normalize_station_name(entry['name']),
+            name=entry['name'],
+            title=entry.get('title'),
+            url=entry['url'],
+            region=entry.get('region') or 'global',
+            codec=entry.get('codec'),
+            bitrate=entry.get('bitrate'),
+            mirrors=tuple(normalize_station_name(mirror) for mirror in entry.get('mirrors') or ()),
+            direct=entry.get('direct'),  # True/False overrides URL classification
+        )
+
+    def search(self, query, limit=10):
+        """Rank stations for a query: exact match, then prefix matches, then trigram similarity"""
+        needle = normalize_station_name(query)
+        if not needle:
+            return list(self._stations.values())[:limit]
+        
+        results = []
+        seen = set()
+        
+        def add(key):
+            if key not in seen:
+                seen.add(key)
+                results.append(self._stations[key])
+        
+        if needle in self._exact:
+            add(self._exact[needle])
+        
+        index = bisect.bisect_left(self._sorted_names, (needle, ''))
+        while index < len(self._sorted_names) and len(results) < limit:
+            term, key = self._sorted_names[index]
+            if not term.startswith(needle):
+                break
+            add(key)
+            index += 1
+        
+        if len(results) < limit:
+            for key, _ in self._fuzzy(needle)[:limit - len(results)]:
+                add(key)
+        return results[:limit]
+
+    def _fuzzy(self, needle, threshold=0.3):
+        """Stations whose name or title shares enough trigrams with the query, best first"""
+        query = _trigrams(needle)
+        shared = {}
+        for trigram in query:
+            for term_id in self._trigram_index.get(trigram, ()):
+                shared[term_id] = shared.get(term_id, 0) + 1
+        
+        best = {}
+        minimum = threshold * len(query)
+        for term_id, count in shared.items():
+            if count < minimum:
+                continue  # Can't reach the threshold even if the term is no longer than the query
+            key, size = self._terms[term_id]
+            score = count / (len(query) + size - count)  # Jaccard similarity
+            if score >= threshold and score > best.get(key, 0):
+                best[key] = score
+        return sorted(best.items(), key=lambda item: -item[1])
+
+    def resolve(self, query):
+        """Find the station a !play query means: exact, unambiguous prefix, or a close fuzzy match"""
+        needle = normalize_station_name(query)
+        # A full name or title wins even when it is also the start of another station's title
+        if needle in self._exact:
+            return self._stations[self._exact[needle]]
+        
+        index = bisect.bisect_left(self._sorted_names, (needle, ''))
+        prefixed = set()
+        while index < len(self._sorted_names) and self._sorted_names[index][0].startswith(needle) and len(prefixed) < 2:
+            prefixed.add(self._sorted_names[index][1])
+            index += 1
+        if len(prefixed) == 1:
+            return self._stations[prefixed.pop()]
+        if prefixed:
+            return None  # Ambiguous prefix
+        
+        fuzzy = self._fuzzy(needle, threshold=0.5)
+        if fuzzy and (len(fuzzy) == 1 or fuzzy[0][1] > fuzzy[1][1]):
+            return self._stations[fuzzy[0][0]]
+        return None
+
+catalog = StationCatalog(STATION_CATALOG_PATH)
+catalog.load()
+
+needs_extraction = {}  # Station whose direct stream failed -> monotonic time until which it goes through yt-dlp instead
+
+def classify_stream_url(url, station=None):
+    """Return ``'direct'`` if FFmpeg can open the URL itself, or ``'extract'`` if it needs yt-dlp"""
+    entry = catalog.get(station) if station else None
+    if time.monotonic() < needs_extraction.get(station, 0):
+        return 'extract'
+    if entry is not None and entry.direct is not None:
+        return 'direct' if entry.direct else 'extract'
+    
+    parts = urlsplit(url)
+    host = (parts.hostname or '').lower()
+    path = parts.path.lower()
+    if any(host == site or host.endswith('.' + site) for site in EXTRACT_ONLY_HOSTS):
+        return 'extract'
+    if path.endswith(DIRECT_STREAM_EXTENSIONS):
+        return 'direct'
+    # Icecast/SHOUTcast servers: a bare host:port, or a streaming host or mount point
+    if parts.port and path in ('', '/'):
+        return 'direct'
+    if host.startswith(('stream.', 'streams.', 'live.', 'icecast.')) or '/stream' in path or '/live' in path:
+        return 'direct'
+    return 'extract'
+
+@tasks.loop(seconds=CATALOG_RELOAD_INTERVAL)
+async def reload_catalog():
+    catalog.reload_if_changed()
+
+class ExtractionService:
+    """Runs yt-dlp on a dedicated, bounded thread pool with one YoutubeDL per worker thread"""
+    def __init__(self, workers, timeout):
+        self.timeout = timeout
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ytdl')
+        self._local = threading.local()
+        self._inflight = {}  # (url, stream) -> asyncio.Future shared by every caller
+        self._pending = {}  # owner (e.g. guild id) -> that owner's latest waiting task
+
+    def _ytdl(self):
+        """Return this thread's YoutubeDL instance (YoutubeDL is not safe to share across threads)"""
+        ytdl = getattr(self._local, 'ytdl', None)
+        if ytdl is None:
+            # Imported here so stations that FFmpeg can open directly never load yt-dlp's extractors
+            import yt_dlp
+            ytdl = self._local.ytdl = yt_dlp.YoutubeDL(dict(ytdl_format_options, socket_timeout=self.timeout))
+        return ytdl
+
+    def _extract_sync(self, url, download):
+        started = time.perf_counter()
+        try:
+            data = self._ytdl().extract_info(url, download=download)
+        except Exception:
+            metric_extraction_seconds.observe(time.perf_counter() - started, result='error')
+            raise
+        metric_extraction_seconds.observe(time.perf_counter() - started, result='ok')
+        
+        if 'entries' in data:
+            data = data['entries'][0]
+        return data
+
+    def prepare_filename(self, data):
+        return self._ytdl().prepare_filename(data)
+
+    async def extract(self, url, *, loop=None, stream=True, owner=None):
+        """Extract a URL, sharing any identical in-flight extraction.
+
+        A newer request from the same ``owner`` cancels that owner's previous wait.
+        """
+        loop = loop or asyncio.get_event_loop()
+        key = (url, stream)
+        future = self._inflight.get(key)
+        if future is None:
+            future = loop.run_in_executor(self._executor, self._extract_sync, url, not stream)
+            self._inflight[key] = future
+            future.add_done_callback(lambda f: self._finish(key, f))
+        
+        waiter = asyncio.ensure_future(asyncio.wait_for(asyncio.shield(future), self.timeout))
+        if owner is not None:
+            previous = self._pending.get(owner)
+            if previous is not None and not previous.done():
+                previous.cancel()
+            self._pending[owner] = waiter
+        
+        try:
+            return await waiter
+        except asyncio.TimeoutError:
+            # Don't let later callers pile onto a hung extraction
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+            raise
+        finally:
+            if owner is not None and self._pending.get(owner) is waiter:
+                del self._pending[owner]
+
+    def _finish(self, key, future):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        # Mark the result as retrieved even if every waiter gave up
+        if not future.cancelled():
+            future.exception()
+
+extraction_service = ExtractionService(EXTRACT_WORKERS, EXTRACT_TIMEOUT)
+
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE  # Bytes in one 20 ms frame of 48 kHz stereo PCM
+FRAME_LENGTH = discord.opus.Encoder.FRAME_LENGTH / 1000  # Seconds per frame
+SILENCE_FRAME = b'\x00' * FRAME_SIZE
+OPUS_SILENCE_FRAME = b'\xf8\xff\xfe'
+
+class PrimedSource(discord.AudioSource):
+    """Serves frames buffered ahead of time, then carries on reading the wrapped source"""
+    def __init__(self, original):
+        self.original = original
+        self._frames = deque()
+
+    def prime(self, frames):
+        """Read up to ``frames`` frames now (blocking), returning how many were buffered"""
+        while len(self._frames) < frames:
+            frame = self.original.read()
+            if not frame:
+                break
+            self._frames.append(frame)
+        return len(self._frames)
+
+    def read(self):
+        if self._frames:
+            return self._frames.popleft()
+        return self.original.read()
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self.original.cleanup()
+
+class JitterBuffer(discord.AudioSource):
+    """Reads a source ahead on its own thread and serves frames from a queue sized to the stream's jitter.
+
+    Each frame's arrival is compared with a real-time schedule anchored at the earliest frame so
+    far, and the target depth follows the latest arrival of the last JITTER_BUFFER_WINDOW seconds.
+    When the queue runs dry it plays silence until it is back at the target, and while it holds
+    more than twice the target it drops the odd frame to cut the added latency again.
+    """
+    def __init__(self, original, station):
+        self.original = original
+        self.station = station or 'unknown'
+        self.path = 'opus' if original.is_opus() else 'pcm'
+        self.target = JITTER_BUFFER_INITIAL_FRAMES
+        self.underruns = 0
+        self._silence = OPUS_SILENCE_FRAME if self.path == 'opus' else SILENCE_FRAME
+        self._frames = deque()
+        self._changed = threading.Condition()
+        self._ended = False
+        self._closed = False
+        self._started = False
+        self._refilling = False
+        self._trimming = False
+        self._since_drop = 0
+        self._anchor = None  # When frame 0 arrived on the earliest schedule seen so far
+        self._received = 0
+        self._first_arrival = None
+        self._peaks = deque()  # [second, latest arrival in seconds] for the last JITTER_BUFFER_WINDOW seconds
+        live_jitter_buffers.add(self)
+        threading.Thread(target=self._fill, daemon=True, name=f'jitter-buffer:{self.station}:{self.path}').start()
+
+    @property
+    def fill(self):
+        return len(self._frames)
+
+    def _fill(self):
+        try:
+            while not self._closed:
+                frame = self.original.read()
+                if not frame or self._closed:
+                    break
+                self._measure(time.perf_counter())
+                with self._changed:
+                    if len(self._frames) >= JITTER_BUFFER_MAX_FRAMES:
+                        self._changed.wait_for(lambda: len(self._frames) < JITTER_BUFFER_MAX_FRAMES or self._closed)
+                        # Arrivals are paced by playback until there is room, start a fresh schedule after
+                        self._anchor = None
+                    self._frames.append(frame)
+                    self._changed.notify_all()
+        except Exception as e:
+            if not self._closed:
+                print(f'❌ Reading {self.station} failed: {e}')
+        finally:
+            with self._changed:
+                self._ended = True
+                self._changed.notify_all()
+
+    def _measure(self, now):
+        if self._first_arrival is None:
+            self._first_arrival = now
+        self._received += 1
+        scheduled = now - self._received * FRAME_LENGTH  # When frame 0 would have arrived at this pace
+        if self._anchor is None or scheduled < self._anchor:
+            self._anchor = scheduled  # Bursts only move the schedule earlier
+        lateness = scheduled - self._anchor
+        
+        second = int(now)
+        if self._peaks and self._peaks[-1][0] == second:
+            if lateness <= self._peaks[-1][1]:
+                return
+            self._peaks[-1][1] = lateness
+        else:
+            self._peaks.append([second, lateness])
+            while self._peaks[0][0] <= second - JITTER_BUFFER_WINDOW:
+                self._peaks.popleft()
+        worst = max(peak for _, peak in self._peaks)
+        target = math.ceil(worst * JITTER_BUFFER_HEADROOM / FRAME_LENGTH)
+        if now - self._first_arrival < JITTER_BUFFER_WINDOW:
+            target = max(target, JITTER_BUFFER_INITIAL_FRAMES)  # Too little history to go below the initial guess
+        self.target = max(JITTER_BUFFER_MIN_FRAMES, min(JITTER_BUFFER_MAX_FRAMES, target))
+
+    def prime(self, frames, timeout):
+        """Wait until ``frames`` frames are queued (blocking), returning False if none arrived"""
+        frames = min(frames, JITTER_BUFFER_MAX_FRAMES)
+        with self._changed:
+            self._changed.wait_for(lambda: len(self._frames) >= frames or self._ended, timeout=timeout)
+            self._started = True
+            return bool(self._frames)
+
+    def read(self):
+        dropped = None
+        with self._changed:
+            if self._started and not self._refilling and not self._frames and not self._ended:
+                self._refilling = True
+                self.underruns += 1
+                metric_jitter_buffer_rebuffers.inc(station=self.station)
+            if (self._refilling or not self._started) and len(self._frames) < self.target and not self._ended:
+                # Blocking here would make discord's AudioPlayer rush the backlog out once it returns
+                if self._started:
+                    metric_frame_underruns.inc(station=self.station)
+                return self._silence
+            self._started = True
+            self._refilling = False
+            if not self._frames:
+                return b''  # Upstream ended, let the player's after callback run
+            
+            if len(self._frames) > self.target * 2:
+                self._trimming = True
+            elif len(self._frames) <= self.target:
+                self._trimming = False
+            if self._trimming and len(self._frames) > 1:
+                self._since_drop += 1
+                if self._since_drop >= JITTER_BUFFER_DROP_INTERVAL:
+                    self._since_drop = 0
+                    dropped = self._frames.popleft()
+                    metric_jitter_buffer_dropped.inc(station=self.station)
+            frame = self._frames.popleft()
+            self._changed.notify_all()
+        
+        if dropped is not None and self.path == 'pcm':
+            # Splice over the dropped frame instead of jumping straight to the next one
+            frame = CrossfadeSource._mix(dropped, frame, 0.0, 1.0)
+        return frame
+
+    def is_opus(self):
+        return self.path == 'opus'
+
+    def cleanup(self):
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        self.original.cleanup()
+
+def find_jitter_buffer(source):
+    """The JitterBuffer a playing source reads from, or None"""
+    while source is not None and not isinstance(source, JitterBuffer):
+        if isinstance(source, BroadcastSubscriber):
+            source = source.broadcast._source
+        else:
+            source = getattr(source, 'original', None)
+    return source
+
+def prime_source(source, frames, timeout):
+    """Buffer the first frames of a station source before it goes on air (blocking).
+
+    Returns False if the stream produced no audio.
+    """
+    if isinstance(source, WorkerSource):
+        return source.prime(frames, timeout)
+    original = source.original
+    if isinstance(original, (BroadcastSubscriber, JitterBuffer)):
+        return original.prime(frames, timeout)
+    
+    primed = PrimedSource(original)
+    source.original = primed
+    return primed.prime(frames) > 0
+
+class CrossfadeSource(discord.AudioSource):
+    """Fades from the outgoing source into the incoming one, then hands over to the incoming source"""
+    def __init__(self, outgoing, incoming, frames, on_finished):
+        self.outgoing = outgoing
+        self.incoming = incoming
+        self._total = frames
+        self._done = 0
+        self._on_finished = on_finished
+        self._released = False
+
+    def __getattr__(self, name):
+        # Expose the incoming source's data, title, path, ... to commands
+        return getattr(self.incoming, name)
+
+    @property
+    def volume(self):
+        return self.incoming.volume
+
+    @volume.setter
+    def volume(self, value):
+        self.incoming.volume = value
+
+    def read(self):
+        frame = self.incoming.read()
+        if self.outgoing is None:
+            return frame
+        
+        old = self.outgoing.read()
+        start = self._done / self._total
+        self._done += 1
+        end = self._done / self._total
+        if len(old) == len(frame) == FRAME_SIZE:
+            frame = self._mix(old, frame, start, end)
+        
+        if self._done >= self._total or not old:
+            outgoing, self.outgoing = self.outgoing, None
+            # Killing FFmpeg can block, keep it off the voice thread
+            threading.Thread(target=outgoing.cleanup, daemon=True).start()
+            self._on_finished(self)
+        return frame
+
+    @staticmethod
+    def _mix(old, new, start, end):
+        if numpy is not None:
+            fade = numpy.repeat(numpy.linspace(start, end, len(new) // 4, endpoint=False, dtype=numpy.float32), 2)
+            mixed = numpy.frombuffer(old, dtype='<i2') * (1 - fade) + numpy.frombuffer(new, dtype='<i2') * fade
+            numpy.clip(mixed, -32768, 32767, out=mixed)
+            return mixed.astype('<i2').tobytes()
+        
+        old_samples, new_samples = array('h', old), array('h', new)
+        if sys.byteorder == 'big':
+            old_samples.byteswap()
+            new_samples.byteswap()
+        step = (end - start) / (len(new_samples) // 2)
+        for i in range(len(new_samples)):
+            fade = start + step * (i // 2)
+            new_samples[i] = max(-32768, min(32767, int(old_samples[i] * (1 - fade) + new_samples[i] * fade)))
+        if sys.byteorder == 'big':
+            new_samples.byteswap()
+        return new_samples.tobytes()
+
+    def is_opus(self):
+        return False
+
+    def release(self):
+        """Hand the incoming source over to the caller, cleanup() leaves it alone from then on"""
+        self._released = True
+        return self.incoming
+
+    def cleanup(self):
+        if self.outgoing is not None:
+            self.outgoing.cleanup()
+        # AudioSource.__del__ calls this when the unwrapped crossfade is collected
+        if not self._released:
+            self.incoming.cleanup()
+
+class StationBroadcast:
+    """Reads one upstream source on its own thread and copies every frame to each subscriber"""
+    def __init__(self, key, source, data, hub):
+        self.key = key
+        self.data = data
+        self.opus = source.is_opus()
+        self.finished = False
+        self._source = source
+        self._hub = hub
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._pump, daemon=True, name=f'broadcast:{key[0]}:{key[1]}')
+        self._thread.start()
+
+    @property
+    def listeners(self):
+        return len(self._subscribers)
+
+    def subscribe(self):
+        subscriber = BroadcastSubscriber(self, BROADCAST_BUFFER_FRAMES)
+        with self._lock:
+            self._subscribers = self._subscribers + [subscriber]
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """Detach a subscriber, returning the number of listeners left"""
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscriber]
+            return len(self._subscribers)
+
+    def close(self):
+        self._closed.set()
+
+    def _pump(self):
+        # Paced like discord's AudioPlayer so a burst from FFmpeg doesn't overflow the subscriber rings
+        try:
+            if isinstance(self._source, JitterBuffer):
+                # Wait for audio here rather than pace silence out to the listeners
+                self._source.prime(self._source.target, SWITCH_PREBUFFER_TIMEOUT)
+            start = time.perf_counter()
+            frames = 0
+            while not self._closed.is_set():
+                frame = self._source.read()
+                if not frame:
+                    break
+                for subscriber in self._subscribers:
+                    subscriber.push(frame)
+                frames += 1
+                delay = start + FRAME_LENGTH * frames - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+        except Exception as e:
+            print(f'❌ Broadcast {self.key} failed: {e}')
+        finally:
+            self.finished = True
+            self._hub.discard(self)
+            self._source.cleanup()
+
+class BroadcastSubscriber(discord.AudioSource):
+    """One listener's view of a StationBroadcast, backed by its own ring buffer"""
+    def __init__(self, broadcast, buffer_frames):
+        self.broadcast = broadcast
+        self._frames = deque(maxlen=buffer_frames)  # Oldest frames drop if this listener stalls
+        self._silence = OPUS_SILENCE_FRAME if broadcast.opus else SILENCE_FRAME
+
+    def push(self, frame):
+        self._frames.append(frame)
+
+    def prime(self, frames, timeout):
+        """Wait until this listener's ring holds ``frames`` frames, returning False if none arrive"""
+        deadline = time.monotonic() + timeout
+        frames = min(frames, self._frames.maxlen)
+        while len(self._frames) < frames and not self.broadcast.finished and time.monotonic() < deadline:
+            time.sleep(FRAME_LENGTH)
+        return len(self._frames) > 0
+
+    def read(self):
+        try:
+            return self._frames.popleft()
+        except IndexError:
+            if self.broadcast.finished:
+                return b''  # Upstream ended, let the player's after callback run
+            metric_frame_underruns.inc(station=self.broadcast.key[0])
+            return self._silence  # Keep the voice connection fed while the upstream catches up
+
+    def is_opus(self):
+        return self.broadcast.opus
+
+    def cleanup(self):
+        broadcast_hub.unsubscribe(self)
+
+class BroadcastHub:
+    """Registry of running StationBroadcasts, one per station"""
+    def __init__(self):
+        self._broadcasts = {}  # station -> StationBroadcast
+        self._lock = threading.Lock()
+
+    def subscribe(self, key, open_source, data):
+        """Join a ``(station, path)`` broadcast, starting it with ``open_source()`` if nobody is listening"""
+        with self._lock:
+            broadcast = self._broadcasts.get(key)
+            if broadcast is None or broadcast.finished:
+                broadcast = self._broadcasts[key] = StationBroadcast(key, open_source(), data, self)
+            return broadcast.subscribe()
+
+    def unsubscribe(self, subscriber):
+        broadcast = subscriber.broadcast
+        with self._lock:
+            # Stop decoding as soon as the last listener leaves
+            if broadcast.unsubscribe(subscriber) == 0:
+                broadcast.close()
+                if self._broadcasts.get(broadcast.key) is broadcast:
+                    del self._broadcasts[broadcast.key]
+
+    def discard(self, broadcast):
+        with self._lock:
+            if self._broadcasts.get(broadcast.key) is broadcast:
+                del self._broadcasts[broadcast.key]
+
+    def get(self, key):
+        return self._broadcasts.get(key)
+
+broadcast_hub = BroadcastHub()
+
+class NowPlaying:
+    """Current track per station, read from in-band stream metadata and shared by every guild.
+
+    A station's track is forgotten when the last stream reading its metadata ends, so a station
+    that is played again later doesn't show a title from its previous broadcast.
+    """
+    def __init__(self):
+        self._tracks = {}  # station -> title
+        self._readers = {}  # station -> open streams reporting its metadata
+        self._lock = threading.Lock()
+
+    def attach(self, station):
+        with self._lock:
+            self._readers[station] = self._readers.get(station, 0) + 1
+
+    def detach(self, station):
+        with self._lock:
+            readers = self._readers.get(station, 0) - 1
+            if readers > 0:
+                self._readers[station] = readers
+            else:
+                self._readers.pop(station, None)
+                self._tracks.pop(station, None)
+
+    def update(self, station, title):
+        """Record a station's track (safe to call from any thread)"""
+        self._tracks[station] = title
+
+    def get(self, station):
+        return self._tracks.get(station)
+
+now_playing = NowPlaying()
+# Station (or URL when there is none) -> monotonic time until which FFmpeg opens it itself. Keyed by
+# station because yt-dlp hands out a new URL on every resolve
+icy_skipped = {}
+
+_STREAM_TITLE = re.compile(rb"StreamTitle='(.*?)';", re.S)
+
+class IcyStream:
+    """File-like HTTP stream with ICY metadata stripped out, for FFmpeg to read from a pipe.
+    
+    Asks the server for in-band metadata and records each StreamTitle in ``now_playing``, so
+    the track comes from the connection that is already feeding FFmpeg. Reads happen on
+    discord.py's pipe writer thread, which also reopens a dropped connection since FFmpeg's
+    -reconnect options don't apply to a pipe.
+    """
+    def __init__(self, url, station):
+        self.url = url
+        self.station = station
+        self.metaint = 0
+        self._response = None
+        self._until_metadata = 0
+        self._failures = 0  # Reconnects since the stream last played steadily
+        self._connected_at = 0
+        self._attached = False
+        self._closed = threading.Event()
+
+    @property
+    def closed(self):
+        return self._closed.is_set()
+
+    def connect(self):
+        """Open the connection (blocking), replacing any previous one"""
+        self._close_response()
+        request = urllib.request.Request(self.url, headers={'Icy-MetaData': '1', 'User-Agent': 'radiobot'})
+        self._response = urllib.request.urlopen(request, timeout=ICY_CONNECT_TIMEOUT)
+        self.metaint = int(self._response.headers.get('icy-metaint') or 0)
+        self._until_metadata = self.metaint
+        self._connected_at = time.monotonic()
+        if not self._attached:
+            now_playing.attach(self.station)
+            self._attached = True
+
+    def read(self, size):
+        while not self.closed:
+            try:
+                data = self._read(size)
+                if data:
+                    # Only a connection that keeps delivering counts as recovered, so a relay that
+                    # sends a little and hangs up still runs out of attempts and ends the stream
+                    if self._failures and time.monotonic() - self._connected_at > RECOVER_STABLE_AFTER:
+                        self._failures = 0
+                    return data
+                if self._response.length is not None:
+                    break  # A file with a known length is simply over
+                error = 'the server closed the stream'  # A live stream never ends on purpose
+            except (OSError, HTTPException) as e:
+                error = e
+            if not self._reconnect(error):
+                break
+        return b''
+
+    def _read(self, size):
+        if not self.metaint:
+            return self._response.read1(size)
+        if not self._until_metadata:
+            self._read_metadata()
+            self._until_metadata = self.metaint
+        data = self._response.read1(min(size, self._until_metadata))
+        self._until_metadata -= len(data)
+        return data
+
+    def _reconnect(self, error):
+        """Reopen a dropped connection with backoff, returning False once it gives up or is closed"""
+        while self._failures < ICY_RECONNECT_ATTEMPTS:
+            self._failures += 1
+            delay = min(2 ** (self._failures - 1), ICY_RECONNECT_DELAY_MAX)
+            print(f'⚠️ Stream {self.station} dropped ({error}), reconnecting in {delay}s')
+            if self._closed.wait(delay):
+                return False
+            try:
+                self.connect()
+                return True
+            except (OSError, HTTPException, ValueError) as e:
+                error = e
+        if not self.closed:
+            print(f'❌ Stream {self.station} failed: {error}')
+        return False
+
+    def close(self):
+        """Stop the stream at its next read (safe to call from any thread)"""
+        self._closed.set()
+
+    def disconnect(self):
+        """Close the connection for good, from the reading thread only since a blocked read holds it"""
+        self._close_response()
+        if self._attached:
+            now_playing.detach(self.station)
+            self._attached = False
+
+    def _close_response(self):
+        if self._response is not None:
+            self._response.close()
+            self._response = None
+
+    def _read_metadata(self):
+        length = self._read_exactly(1)[0] * 16
+        if not length:
+            return  # Unchanged since the last block
+        match = _STREAM_TITLE.search(self._read_exactly(length))
+        if match and match.group(1).strip():
+            raw = match.group(1).strip()
+            try:
+                title = raw.decode('utf-8')
+            except UnicodeDecodeError:
+                title = raw.decode('latin-1')  # What older servers send
+            now_playing.update(self.station, title)
+
+    def _read_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self._response.read(size - len(data))
+            if not chunk:
+                raise OSError('stream ended inside a metadata block')
+            data += chunk
+        return data
+
+class IcyPipe:
+    """Mixin for FFmpeg sources fed from an IcyStream.
+    
+    discord.py's pipe writer assumes the source is never cleaned up while it waits on a read, but
+    a network read can take a while. Write to the pipe captured at startup instead and close
+    the stream on cleanup, so the writer thread just ends when playback does and leaves closing
+    the pipe to discord.py's cleanup.
+    """
+    def _pipe_writer(self, source):
+        stdin = self._stdin
+        try:
+            while self._process:
+                data = source.read(8192)
+                if not data:
+                    # End of stream, let FFmpeg drain. Its cleanup would flush a closed stdin, so detach it
+                    stdin.close()
+                    self._process.stdin = None
+                    break
+                stdin.write(data)
+        except Exception:
+            pass  # FFmpeg exited or the stream was closed under us, either way playback is over
+        finally:
+            source.disconnect()
+
+    def cleanup(self):
+        self._icy_stream.close()
+        super().cleanup()
+
+class IcyPCMAudio(IcyPipe, discord.FFmpegPCMAudio):
+    def __init__(self, stream, **kwargs):
+        self._icy_stream = stream
+        super().__init__(stream, pipe=True, **kwargs)
+
+class IcyOpusAudio(IcyPipe, discord.FFmpegOpusAudio):
+    def __init__(self, stream, **kwargs):
+        self._icy_stream = stream
+        super().__init__(stream, pipe=True, **kwargs)
+
+def reads_icy_metadata(station, url):
+    """Whether the bot should pull this stream itself to read its metadata"""
+    if not ICY_METADATA or time.monotonic() < icy_skipped.get(station, 0):
+        return False
+    parts = urlsplit(url)
+    return parts.scheme in ('http', 'https') and not parts.path.lower().endswith(('.m3u8', '.mpd'))
+
+def connect_icy_stream(url, station):
+    """Connect to a stream (blocking), returning an IcyStream if the server sends metadata and None otherwise"""
+    stream = IcyStream(url, station)
+    try:
+        stream.connect()
+    except Exception as e:
+        # FFmpeg gets to try the URL itself. An HTTP protocol error is usually an old SHOUTcast
+        # 'ICY 200 OK' reply, which won't get better, so that station is left to FFmpeg from now on.
+        # Anything else is left to it for a while, so a slow host doesn't hold up every play and retry
+        print(f'⚠️ Reading {station} ourselves failed ({e!r}), handing it to FFmpeg')
+        icy_skipped[station] = math.inf if isinstance(e, HTTPException) else time.monotonic() + ICY_RETRY_AFTER
+        stream.disconnect()
+        return None
+    if not stream.metaint:
+        # Nothing to read, and FFmpeg's own connection keeps its -reconnect options
+        icy_skipped[station] = math.inf
+        stream.disconnect()
+        return None
+    return stream
+
+def open_station_source(station, stream_url, data, *, opus=False):
+    """Open a PCM (or Opus) source for a station, sharing its decoder with other guilds when enabled.
+
+    Connects to streams whose metadata the bot reads itself, so it blocks and belongs off the event loop.
+    """
+    key = (station, 'opus' if opus else 'pcm')
+    shared = SHARED_BROADCAST and station
+    icy = None
+    if reads_icy_metadata(station or stream_url, stream_url):
+        broadcast = broadcast_hub.get(key) if shared else None
+        if broadcast is None or broadcast.finished:
+            # Connected here rather than in open_ffmpeg, which runs under the hub's lock
+            icy = connect_icy_stream(stream_url, station or stream_url)
+
+    def open_ffmpeg():
+        nonlocal icy
+        pcm_class, opus_class = discord.FFmpegPCMAudio, discord.FFmpegOpusAudio
+        stream, before_options = stream_url, ffmpeg_options['before_options']
+        if icy is not None:
+            # The -reconnect options only apply to URLs, IcyStream reconnects by itself
+            pcm_class, opus_class = IcyPCMAudio, IcyOpusAudio
+            stream, before_options = icy, ''
+        if opus:
+            # Bake the default volume into FFmpeg's output so both paths sound the same. One-frame Ogg
+            # pages hand packets over as they are encoded instead of in one-second bursts
+            source = opus_class(stream, bitrate=OPUS_BITRATE, before_options=before_options,
+                                options=f"{ffmpeg_options['options']} -af volume={DEFAULT_VOLUME} -page_duration 20000")
+        else:
+            source = pcm_class(stream, before_options=before_options, options=ffmpeg_options['options'])
+        icy = None  # FFmpeg's pipe writer owns it now
+        live_ffmpeg_sources.add(source)
+        metric_ffmpeg_spawned.inc(path='opus' if opus else 'pcm')
+        if JITTER_BUFFER:
+            return JitterBuffer(source, station)
+        return source
+    
+    try:
+        if shared:
+            return broadcast_hub.subscribe(key, open_ffmpeg, data)
+        return open_ffmpeg()
+    finally:
+        if icy is not None:
+            icy.disconnect()  # FFmpeg failed to start, or another guild started the broadcast meanwhile
+
+def use_opus_passthrough(volume):
+    return OPUS_PASSTHROUGH and volume == DEFAULT_VOLUME
+
+AUDIO_PATH_NAMES = {'opus': 'Opus passthrough', 'worker': 'PCM volume (worker process)', 'pcm': 'PCM volume'}
+
+def audio_path(volume):
+    """The path a station at this volume plays through: 'opus', 'worker' or 'pcm'"""
+    if use_opus_passthrough(volume):
+        return 'opus'
+    return 'worker' if audio_workers.running else 'pcm'
+
+def build_station_source(station, data, volume):
+    """Wrap a station's stream in the Opus passthrough, worker or PCM volume path, whichever the volume allows"""
+    path = audio_path(volume)
+    if path == 'opus':
+        source = OpusPassthroughSource(open_station_source(station, data['url'], data, opus=True), data=data)
+    elif path == 'worker':
+        source = audio_workers.open(data, volume)
+    else:
+        source = YTDLSource(open_station_source(station, data['url'], data), data=data, volume=volume)
+    source.monitor = FrameMonitor(station)
+    return source
+
+async def create_station_source(station, data, volume):
+    """build_station_source on the default executor, since connecting to read stream metadata blocks"""
+    future = bot.loop.run_in_executor(None, build_station_source, station, data, volume)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        # Nobody will play it, but FFmpeg still has to be shut down once it has started
+        future.add_done_callback(_cleanup_abandoned_source)
+        raise
+
+def _cleanup_abandoned_source(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().cleanup()
+
+class WorkerSource(discord.AudioSource):
+    """Opus frames produced by an audio worker process for one stream"""
+    path = 'worker'
+
+    def __init__(self, worker, stream_id, *, data, volume):
+        self.worker = worker
+        self.stream_id = stream_id
+        self.data = data
+        self.title = data.get('title')
+        self.url = data.get('url')
+        self.monitor = FrameMonitor(None)
+        self.error = None
+        self._volume = volume
+        self._frames = deque(maxlen=WORKER_BUFFER_FRAMES)
+        self._arrived = threading.Condition()
+        self._ended = False
+        self._started = False
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value):
+        self._volume = value
+        self.worker.send(('volume', self.stream_id, value))
+
+    def feed(self, frame):
+        """Called from the worker's reader thread"""
+        with self._arrived:
+            self._frames.append(frame)
+            self._arrived.notify()
+
+    def end(self, error=None):
+        with self._arrived:
+            self.error = self.error or error
+            self._ended = True
+            self._arrived.notify_all()
+
+    def prime(self, frames, timeout):
+        """Wait until ``frames`` frames are buffered (blocking), returning False if none arrived"""
+        deadline = time.monotonic() + timeout
+        with self._arrived:
+            while len(self._frames) < frames and not self._ended:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._arrived.wait(remaining)
+            return bool(self._frames)
+
+    def read(self):
+        with self._arrived:
+            if self._frames:
+                self._started = True
+                frame = self._frames.popleft()
+            elif self._ended:
+                if self.error:
+                    raise RuntimeError(self.error)
+                frame = b''
+            elif not self._started:
+                # Blocking here would make the AudioPlayer rush the first frames out to catch up
+                frame = OPUS_SILENCE_FRAME
+            else:
+                metric_frame_underruns.inc(station=self.monitor.station)
+                frame = OPUS_SILENCE_FRAME
+        self.monitor.tick(frame)
+        return frame
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.worker.close(self.stream_id)
+
+class AudioWorker:
+    """One audio worker process and the thread that routes its frames to WorkerSources"""
+    def __init__(self, pool, index):
+        self.pool = pool
+        self.index = index
+        self.sources = {}  # stream id -> WorkerSource
+        self.ready = threading.Event()
+        self.error = None
+        self._send_lock = threading.Lock()
+        self.process = subprocess.Popen([sys.executable, audio_worker.__file__, str(WORKER_READ_AHEAD)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        self.outgoing = Connection(os.dup(self.process.stdin.fileno()), readable=False)
+        self.incoming = Connection(os.dup(self.process.stdout.fileno()), writable=False)
+        self.process.stdin.close()
+        self.process.stdout.close()
+        threading.Thread(target=self._receive, name=f'audio-worker-{index}', daemon=True).start()
+
+    def send(self, message):
+        with self._send_lock:
+            try:
+                self.outgoing.send(message)
+            except (BrokenPipeError, OSError):
+                pass  # The reader thread ends this worker's streams
+
+    def close(self, stream_id):
+        if self.sources.pop(stream_id, None) is not None:
+            self.send(('close', stream_id))
+
+    def _receive(self):
+        header = audio_worker.HEADER
+        while True:
+            try:
+                message = self.incoming.recv_bytes()
+            except (EOFError, OSError):
+                break
+            stream_id, kind = header.unpack_from(message)
+            if stream_id == audio_worker.READY_STREAM:
+                self.error = message[header.size:].decode(errors='replace') if kind == audio_worker.ERROR else None
+                self.ready.set()
+                continue
+            source = self.sources.get(stream_id)
+            if source is None:
+                continue  # Closed while frames were still in flight
+            if kind == audio_worker.FRAME:
+                source.feed(message[header.size:])
+            else:
+                self.sources.pop(stream_id, None)
+                source.end(message[header.size:].decode(errors='replace') if kind == audio_worker.ERROR else None)
+        
+        # The process exited: end its streams so the playback supervisor restarts them elsewhere
+        self.process.wait()
+        for source in list(self.sources.values()):
+            source.end('audio worker exited')
+        self.sources.clear()
+        self.ready.set()
+        self.pool.replace(self)
+
+class AudioWorkerPool:
+    """Spreads PCM-path streams over AUDIO_WORKERS processes, least busy first"""
+    def __init__(self, size):
+        self.size = size
+        self.workers = []
+        self.running = False
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    def start(self, timeout=30):
+        """Start the workers (blocking) and wait for them to load the Opus encoder"""
+        if not self.size:
+            return
+        self.workers = [AudioWorker(self, index) for index in range(self.size)]
+        for worker in self.workers:
+            worker.ready.wait(timeout)
+        errors = {worker.error for worker in self.workers if worker.error or not worker.ready.is_set()}
+        if errors:
+            print(f'❌ Audio workers unavailable, keeping the PCM path in process: {errors.pop() or "timed out"}')
+            self.stop()
+            return
+        self.running = True
+        print(f'🧵 Started {self.size} audio worker processes')
+
+    def stop(self):
+        self.running = False
+        for worker in self.workers:
+            worker.process.terminate()
+        self.workers = []
+
+    def open(self, data, volume):
+        with self._lock:
+            worker = min(self.workers, key=lambda worker: len(worker.sources))
+            self._next_id += 1
+            stream_id = self._next_id
+        source = WorkerSource(worker, stream_id, data=data, volume=volume)
+        worker.sources[stream_id] = source
+        worker.send(('open', stream_id, data['url'], ffmpeg_options['before_options'], ffmpeg_options['options'], volume, LOUDNESS_NORMALIZATION))
+        return source
+
+    def replace(self, worker):
+        """Start a new process in place of one that exited (called from its reader thread)"""
+        if not self.running or worker not in self.workers:
+            return
+        print(f'⚠️ Audio worker {worker.index} exited (code {worker.process.returncode}), starting a new one')
+        metric_worker_restarts.inc()
+        replacement = AudioWorker(self, worker.index)
+        with self._lock:
+            self.workers[self.workers.index(worker)] = replacement
+
+audio_workers = AudioWorkerPool(AUDIO_WORKERS)
+
+class OpusPassthroughSource(discord.AudioSource):
+    """Hands FFmpeg-encoded Opus packets straight to the voice client"""
+    path = 'opus'
+
+    def __init__(self, original, *, data):
+        self.original = original
+        self.data = data
+        self.title = data.get('title')
+        self.url = data.get('url')
+        self.monitor = FrameMonitor(None)
+
+    def read(self):
+        frame = self.original.read()
+        self.monitor.tick(frame)
+        return frame
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self.original.cleanup()
+
+class YTDLSource(GainTransformer):
+    path = 'pcm'
+
+    def __init__(self, source, *, data, volume=DEFAULT_VOLUME):
+        super().__init__(source, volume, normalize=LOUDNESS_NORMALIZATION)
+        self.data = data
+        self.title = data.get('title')
+        self.url = data.get('url')
+        self.monitor = FrameMonitor(None)
+
+    def read(self):
+        frame = super().read()
+        self.monitor.tick(frame)
+        return frame
+
+    @classmethod
+    async def from_url(cls, url, *, loop=None, stream=False, cache_key=None, owner=None, volume=DEFAULT_VOLUME):
+        """Resolve a URL into a playable source.
+
+        Streams at the default volume come back as an OpusPassthroughSource when enabled.
+        """
+        started = time.perf_counter()
+        if stream and classify_stream_url(url, cache_key) == 'direct':
+            entry = catalog.get(cache_key) if cache_key else None
+            cache = 'direct'  # Played without extraction, kept apart so it doesn't inflate the hit rate
+            data = {'url': url, 'title': entry.title if entry else None, 'direct': True}
+        elif stream and cache_key:
+            cache = 'hit' if stream_cache.get(cache_key) is not None else 'miss'
+            data = await stream_cache.resolve(cache_key, url, loop=loop, owner=owner)
+            if data.get('url') == url:
+                needs_extraction.pop(cache_key, None)  # yt-dlp had nothing better than the direct URL
+        else:
+            cache = 'miss'
+            data = await extraction_service.extract(url, loop=loop, stream=stream, owner=owner)
+        metric_resolve_seconds.observe(time.perf_counter() - started, cache=cache)
+        
+        if not stream:
+            filename = extraction_service.prepare_filename(data)
+            return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data, volume=volume)
+        
+        return await create_station_source(cache_key, data, volume)
+
+class StreamCache:
+    """TTL cache of resolved stream info, keyed by station name"""
+    def __init__(self, ttl, refresh_margin):
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self._entries = {}  # station -> [data, source url, expires_at, last_used]
+        self._refreshing = {}  # station -> asyncio.Task
+
+    def get(self, station):
+        """Return cached stream info for a station, or None if missing or expired"""
+        entry = self._entries.get(station)
+        if entry is None:
+            return None
+        
+        now = time.monotonic()
+        if now >= entry[2]:
+            self._entries.pop(station, None)
+            return None
+        
+        entry[3] = now
+        return entry[0]
+
+    def put(self, station, url, data, *, ttl=None, persist=True):
+        now = time.monotonic()
+        ttl = self.ttl if ttl is None else ttl
+        self._entries[station] = [data, url, now + ttl, now]
+        if persist:
+            state_store.save_stream(station, url, data, time.time() + ttl)
+
+    def evict(self, station):
+        """Drop a station's cached stream (safe to call from the voice thread)"""
+        if self._entries.pop(station, None) is not None:
+            state_store.delete_stream(station)
+            print(f'🗑️ Evicted cached stream for {station}')
+
+    async def resolve(self, station, url, *, loop=None, owner=None):
+        """Return stream info for a station, extracting only on a cache miss"""
+        data = self.get(station)
+        if data is not None:
+            return data
+        
+        # An in-progress background refresh of the same URL is shared by the extraction service
+        data = await extraction_service.extract(url, loop=loop, stream=True, owner=owner)
+        self.put(station, url, data)
+        return data
+
+    def refresh_expiring(self):
+        """Start background re-resolution for recently used entries close to expiry"""
+        now = time.monotonic()
+        for station, (data, url, expires_at, last_used) in list(self._entries.items()):
+            if station in self._refreshing:
+                continue
+            if expires_at - now > self.refresh_margin:
+                continue
+            if now - last_used > self.ttl:
+                continue  # Nobody has played it recently, let it expire
+            self._refreshing[station] = asyncio.ensure_future(self._refresh(station, url))
+
+    async def _refresh(self, station, url):
+        try:
+            data = await extraction_service.extract(url, stream=True)
+            last_used = self._entries.get(station, [None, None, None, time.monotonic()])[3]
+            self.put(station, url, data)
+            self._entries[station][3] = last_used
+        except Exception as e:
+            print(f'❌ Background refresh failed for {station}: {e}')
+            self._entries.pop(station, None)
+        finally:
+            self._refreshing.pop(station, None)
+
+stream_cache = StreamCache(STREAM_CACHE_TTL, STREAM_CACHE_REFRESH_MARGIN)
+
+def evict_if_failed(station, started, error):
+    """Evict a station's cached URL if its playback errored or ended almost immediately"""
+    # A live stream ending almost immediately means FFmpeg could not open the URL
+    if error or time.monotonic() - started < STREAM_CACHE_FAIL_WINDOW:
+        stream_cache.evict(station)
+        entry = catalog.get(station) if station else None
+        if entry and classify_stream_url(entry.url, station) == 'direct':
+            # Only for a while, the failure may just have been an upstream drop
+            print(f'↪️ Direct stream for {station} failed, using yt-dlp for it for the next {DIRECT_STREAM_RETRY_AFTER // 60} min')
+            needs_extraction[station] = time.monotonic() + DIRECT_STREAM_RETRY_AFTER
+    if error:
+        print(f'Player error: {error}')
+
+@tasks.loop(seconds=30)
+async def refresh_stream_cache():
+    stream_cache.refresh_expiring()
+
+ProbeResult = namedtuple('ProbeResult', 'ok latency codec via error checked_at')
+
+class StationProber:
+    """Resolves stations with a bounded number of parallel workers and records their health"""
+    def __init__(self, concurrency, timeout):
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.results = {}  # station -> ProbeResult
+
+    def is_dead(self, station):
+        result = self.results.get(station)
+        return result is not None and not result.ok
+
+    async def probe_all(self, stations):
+        """Probe every station in a ``{name: url}`` mapping"""
+        semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        
+        async with aiohttp.ClientSession() as session:
+            async def run(station, url):
+                async with semaphore:
+                    await self.probe_station(station, url, session)
+            
+            await asyncio.gather(*(run(station, url) for station, url in stations.items()))
+        
+        dead = sum(1 for station in stations if self.is_dead(station))
+        print(f'📡 Probed {len(stations)} stations in {time.monotonic() - started:.1f}s ({dead} unreachable)')
+
+    async def probe_station(self, station, url, session):
+        started = time.monotonic()
+        try:
+            if classify_stream_url(url, station) == 'direct':
+                raise LookupError('direct stream, nothing to extract')
+            # Resolving through the cache means the first !play of this station starts instantly
+            data = await asyncio.wait_for(stream_cache.resolve(station, url), self.timeout)
+            codec = data.get('acodec') if data.get('acodec') not in (None, 'none') else data.get('ext')
+            result = ProbeResult(True, time.monotonic() - started, codec, 'extracted', None, time.time())
+        except Exception:
+            # Direct streams, and !play's fallback when extraction fails, hand the URL straight to FFmpeg
+            try:
+                codec = await asyncio.wait_for(self._probe_direct(url, session), self.timeout)
+                result = ProbeResult(True, time.monotonic() - started, codec, 'direct', None, time.time())
+            except Exception as direct_error:
+                error = str(direct_error) or type(direct_error).__name__
+                result = ProbeResult(False, time.monotonic() - started, None, None, error, time.time())
+        
+        self.results[station] = result
+        return result
+
+    @staticmethod
+    async def _probe_direct(url, session):
+        """Open the stream URL directly and return a codec guess from its content type"""
+        async with session.get(url, headers={'Icy-MetaData': '0'}) as response:
+            if response.status >= 400:
+                raise RuntimeError(f'HTTP {response.status}')
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if not content_type.startswith(('audio/', 'application/vnd.apple.mpegurl', 'application/x-mpegurl', 'application/ogg')):
+                raise RuntimeError(f'not an audio stream ({content_type or "no content type"})')
+            return content_type.split('/')[-1]
+
+station_prober = StationProber(PROBE_CONCURRENCY, PROBE_TIMEOUT)
+
+@tasks.loop(seconds=PROBE_INTERVAL)
+async def probe_stations():
+    await station_prober.probe_all(catalog.urls())
+
+class PlaybackSupervisor:
+    """Watches a guild's playback and restarts the stream, or one of its mirrors, when it drops"""
+    def __init__(self, player):
+        self.player = player
+        self.generation = 0  # Bumped whenever playback is started or stopped on purpose
+        self.restarts = 0
+        self.last_outage = None  # Seconds of silence before the most recent recovery
+        self._failures = 0
+        self._dropped_at = None
+        self._started_at = 0
+        self._task = None
+        self._token = None  # [station, generation, started] read by the running player's after callback
+
+    def begin(self, *, recovering=False):
+        """Mark the current playback as intentionally replaced and return the new generation"""
+        self.generation += 1
+        self._started_at = time.monotonic()
+        if not recovering:
+            self._failures = 0
+            self._dropped_at = None
+            if self._task and not self._task.done() and self._task is not asyncio.current_task():
+                self._task.cancel()
+        return self.generation
+
+    def cancel(self):
+        """Stop supervising until playback is started again"""
+        self.begin()
+
+    def is_current(self, generation):
+        return generation == self.generation
+
+    @property
+    def recovering(self):
+        """Whether a dropped stream is waiting to be restarted"""
+        return self._task is not None and not self._task.done()
+
+    def after_callback(self, station, generation):
+        """Build the voice client's ``after`` callback for one playback"""
+        token = self._token = [station, generation, time.monotonic()]
+        
+        def after(error):
+            station, generation, started = token
+            # A stop or switch bumps the generation first, so a quick !stop doesn't look like a dead URL
+            if error or self.is_current(generation):
+                evict_if_failed(station, started, error)
+            bot.loop.call_soon_threadsafe(self._on_end, generation, error)
+        
+        return after
+
+    def retarget(self, station, generation):
+        """Point the running player's after callback at a source that was swapped in place"""
+        if self._token is not None:
+            self._token[:] = [station, generation, time.monotonic()]
+
+    def _on_end(self, generation, error):
+        if generation != self.generation or not AUTO_RECOVER:
+            return  # Stopped or replaced on purpose
+        
+        station = self.player.station
+        if station is None:
+            return
+        
+        now = time.monotonic()
+        if now - self._started_at > RECOVER_STABLE_AFTER:
+            self._failures = 0
+            self._dropped_at = None
+        if self._dropped_at is None:
+            self._dropped_at = now
+        self._failures += 1
+        
+        print(f'⚠️ Stream {station} dropped in guild {self.player.guild_id}' + (f': {error}' if error else ''))
+        self._task = asyncio.ensure_future(self._recover(station, generation))
+
+    def _backoff(self):
+        delay = min(RECOVER_MAX_DELAY, RECOVER_BASE_DELAY * 2 ** (self._failures - 2))
+        return delay * random.uniform(0.5, 1.5)
+
+    async def _recover(self, station, generation):
+        entry = catalog.get(station)
+        candidates = [station] + [mirror for mirror in (entry.mirrors if entry else ()) if mirror in catalog]
+        
+        while self._failures <= RECOVER_MAX_ATTEMPTS:
+            # The first retry is immediate, later rounds back off
+            if self._failures > 1:
+                await asyncio.sleep(self._backoff())
+            
+            for candidate in candidates:
+                if generation != self.generation:
+                    return  # Someone started or stopped playback meanwhile
+                
+                voice_client = self.player.voice_client
+                if voice_client is None or not voice_client.is_connected():
+                    break
+                
+                # The cached URL may be what went stale
+                stream_cache.evict(candidate)
+                try:
+                    await start_playback(self.player, candidate, recovering=True)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f'❌ Restarting {candidate} failed: {e}')
+                    generation = self.generation  # start_playback claimed a new generation for this attempt
+                    continue
+                
+                self.restarts += 1
+                metric_stream_restarts.inc(station=candidate)
+                self.last_outage = time.monotonic() - self._dropped_at
+                note = f" (mirror of **{station.upper()}**)" if candidate != station else ""
+                print(f'🔄 Restarted {candidate} in guild {self.player.guild_id} after {self.last_outage:.1f}s of silence')
+                await self.player.announce(f"🔄 Stream dropped, now playing **{candidate.upper()}**{note} again")
+                return
+            
+            self._failures += 1
+        
+        print(f'❌ Giving up on {station} in guild {self.player.guild_id}')
+        await self.player.announce(f"❌ Lost **{station.upper()}** and couldn't reconnect. Use `!play` to try again.")
+
+# Persisted runtime state
+class StateStore:
+    """SQLite store for per-guild settings and resolved stream URLs.
+    
+    Each write is its own transaction, so a crash or deploy leaves the last committed state
+    behind. Failures are logged and otherwise ignored, the bot keeps working from memory.
+    """
+    SCHEMA = (
+        'CREATE TABLE IF NOT EXISTS guilds (guild_id INTEGER PRIMARY KEY, channel_id INTEGER, '
+        'voice_channel_id INTEGER, station TEXT, volume REAL, announce_channel_id INTEGER)',
+        'CREATE TABLE IF NOT EXISTS streams (station TEXT PRIMARY KEY, url TEXT, data TEXT, expires_at REAL)',
+    )
+    STREAM_FIELDS = ('url', 'title', 'acodec', 'ext', 'direct')  # All a cached stream needs to be played again
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()  # Cache evictions arrive from voice threads
+
+    def open(self):
+        if not self.path:
+            return
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        with connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+        self._connection = connection
+
+    def _write(self, sql, params):
+        if self._connection is None:
+            return
+        try:
+            with self._lock, self._connection:
+                self._connection.execute(sql, params)
+        except sqlite3.Error as e:
+            print(f'❌ Could not save state: {e}')
+
+    def _read(self, sql):
+        if self._connection is None:
+            return []
+        with self._lock:
+            return self._connection.execute(sql).fetchall()
+
+    def save_player(self, player):
+        voice_client = player.voice_client
+        voice_channel_id = voice_client.channel.id if voice_client and voice_client.channel else None
+        self._write('INSERT OR REPLACE INTO guilds VALUES (?, ?, ?, ?, ?, ?)',
+                    (player.guild_id, player.channel_id, voice_channel_id, player.station, player.volume, player.announce_channel_id))
+
+    def save_stream(self, station, url, data, expires_at):
+        """Remember a resolved stream; ``expires_at`` is wall-clock time since monotonic time restarts with the process"""
+        trimmed = {key: data[key] for key in self.STREAM_FIELDS if key in data}
+        self._write('INSERT OR REPLACE INTO streams VALUES (?, ?, ?, ?)', (station, url, json.dumps(trimmed), expires_at))
+
+    def delete_stream(self, station):
+        self._write('DELETE FROM streams WHERE station = ?', (station,))
+
+    def restore(self, players, stream_cache):
+        """Load saved guilds into the player manager and unexpired streams into the cache"""
+        restored = 0
+        for guild_id, channel_id, voice_channel_id, station, volume, announce_channel_id in self._read('SELECT * FROM guilds'):
+            player = players.get(guild_id)
+            player.channel_id = player.channel_id or channel_id
+            player.volume = volume if volume is not None else DEFAULT_VOLUME
+            player.announce_channel_id = announce_channel_id
+            if station:
+                player.resume_station, player.resume_channel_id = station, voice_channel_id
+            restored += 1
+        
+        now = time.time()
+        warmed = 0
+        for station, url, data, expires_at in self._read('SELECT * FROM streams'):
+            if expires_at > now:
+                stream_cache.put(station, url, json.loads(data), ttl=expires_at - now, persist=False)
+                warmed += 1
+        if restored or warmed:
+            print(f'💾 Restored {restored} guild(s) and {warmed} cached stream(s) from {os.path.basename(self.path)}')
+
+state_store = StateStore(STATE_DB_PATH)
+
+# Per-guild player state
+class VoiceConnection:
+    """Voice connection state machine for one guild: disconnected, connecting, connected or moving.
+    
+    Every join, move and rejoin goes through connect(), which runs one at a time per guild,
+    moves an existing connection instead of reconnecting and retries failed handshakes with
+    jittered exponential backoff.
+    """
+    DISCONNECTED = 'disconnected'
+    CONNECTING = 'connecting'
+    CONNECTED = 'connected'
+    MOVING = 'moving'
+
+    def __init__(self, player):
+        self.player = player
+        self.failures = 0  # Failed handshakes since the last successful connect
+        self._busy = None  # CONNECTING or MOVING while a transition is in flight
+        self._lock = asyncio.Lock()
+        self._rejoin_task = None
+        self._left = False  # Set by disconnect() so a deliberate leave is not undone by a rejoin
+
+    @property
+    def state(self):
+        if self._busy:
+            return self._busy
+        voice_client = self.player.voice_client
+        return self.CONNECTED if voice_client and voice_client.is_connected() else self.DISCONNECTED
+
+    async def connect(self, channel):
+        """Make sure the guild is connected to ``channel`` and return its voice client"""
+        async with self._lock:
+            self._left = False
+            voice_client = self.player.voice_client
+            if voice_client and voice_client.is_connected():
+                if voice_client.channel.id != channel.id:
+                    self._busy = self.MOVING
+                    try:
+                        await voice_client.move_to(channel)
+                    finally:
+                        self._busy = None
+                    metric_voice_connects.inc(outcome='moved')
+                return voice_client
+
+            if voice_client:
+                # Left behind by a connection that dropped without cleaning up
+                await voice_client.disconnect(force=True)
+            self._busy = self.CONNECTING
+            try:
+                return await self._handshake(channel)
+            finally:
+                self._busy = None
+
+    async def _handshake(self, channel):
+        for attempt in range(VOICE_CONNECT_ATTEMPTS):
+            if attempt:
+                await asyncio.sleep(self._backoff())
+            try:
+                voice_client = await channel.connect(timeout=VOICE_CONNECT_TIMEOUT, reconnect=True)
+            except (asyncio.TimeoutError, discord.DiscordException, OSError) as e:
+                self.failures += 1
+                metric_voice_connects.inc(outcome='failed')
+                print(f'❌ Voice connect to {channel.name} failed (attempt {attempt + 1}/{VOICE_CONNECT_ATTEMPTS}): {e}')
+                if attempt + 1 == VOICE_CONNECT_ATTEMPTS:
+                    raise
+                # A timed out handshake can leave a half-open client behind
+                if self.player.voice_client:
+                    await self.player.voice_client.disconnect(force=True)
+                continue
+            self.failures = 0
+            metric_voice_connects.inc(outcome='connected')
+            return voice_client
+
+    def _backoff(self):
+        delay = min(VOICE_RECONNECT_MAX_DELAY, VOICE_RECONNECT_BASE_DELAY * 2 ** (self.failures - 1))
+        return delay * random.uniform(0.5, 1.5)
+
+    async def disconnect(self):
+        """Leave voice on purpose, cancelling any pending rejoin"""
+        self._left = True
+        if self._rejoin_task is not None:
+            self._rejoin_task.cancel()
+            self._rejoin_task = None
+        async with self._lock:
+            voice_client = self.player.voice_client
+            if voice_client:
+                await voice_client.disconnect()
+
+    def schedule_rejoin(self):
+        """Rejoin the designated channel after a drop; calls while a rejoin is pending are ignored"""
+        if self._left or not self.player.channel_id:
+            return
+        if self._rejoin_task is not None and not self._rejoin_task.done():
+            return
+        self._rejoin_task = asyncio.create_task(self._rejoin())
+
+    async def _rejoin(self):
+        await asyncio.sleep(VOICE_REJOIN_DELAY)
+        channel = self.player.channel
+        if channel is None:
+            return
+        voice_client = self.player.voice_client
+        # discord.py resumes dropped sessions on its own, so give it the chance before starting over
+        deadline = time.monotonic() + VOICE_CONNECT_TIMEOUT
+        while voice_client and not voice_client.is_connected() and time.monotonic() < deadline:
+            await asyncio.sleep(1)
+            voice_client = self.player.voice_client
+        if voice_client and voice_client.is_connected() and voice_client.channel.id == channel.id:
+            return
+        try:
+            await self.connect(channel)
+            print(f'🔄 Reconnected to target channel: {channel.name}')
+        except Exception as e:
+            print(f'❌ Error rejoining target channel: {e}')
 
-# Configuration - Set your specific channel and guild IDs
-TARGET_GUILD_ID = None  # Replace with your server ID (right-click server -> Copy ID)
-TARGET_CHANNEL_ID = None  # Replace with your voice channel ID (right-click channel -> Copy ID)
-AUTO_JOIN_ON_STARTUP = True  # Set to True to auto-join on bot start
+class GuildPlayer:
+    """Radio session for one guild: designated channel, current station and volume"""
+    def __init__(self, guild_id, channel_id=None):
+        self.guild_id = guild_id
+        self.channel_id = channel_id  # Designated voice channel, None for free roam
+        self.station = None  # Catalog key of the station being played
+        self.volume = DEFAULT_VOLUME
+        self.announce_channel_id = None  # Text channel of the last !play, for playback notices
+        self.last_switch_latency = None  # Seconds from the last !play until the new station was on air
+        self.resume_station = None  # Station that was playing before a restart, until it has been resumed
+        self.resume_channel_id = None  # Voice channel it was playing in
+        self.supervisor = PlaybackSupervisor(self)
+        self.connection = VoiceConnection(self)
+
+    def save(self):
+        """Persist this guild's channel, station and volume"""
+        state_store.save_player(self)
+
+    async def announce(self, message):
+        """Post a playback notice where the radio was last controlled from"""
+        channel = bot.get_channel(self.announce_channel_id) if self.announce_channel_id else None
+        if channel is None:
+            return
+        try:
+            await channel.send(message)
+        except discord.HTTPException as e:
+            print(f'❌ Could not post notice in guild {self.guild_id}: {e}')
+
+    @property
+    def guild(self):
+        return bot.get_guild(self.guild_id)
 
-# Radio stations database
-RADIO_STATIONS = {
-    # Global/International
-    'bbc1': 'https://stream.live.vc.bbcmedia.co.uk/bbc_radio_one',
-    'bbc2': 'https://stream.live.vc.bbcmedia.co.uk/bbc_radio_two',
-    'cnn': 'https://tunein.com/radio/CNN-s2752/',
+    @property
+    def channel(self):
+        """The designated voice channel, if one is set and still exists"""
+        guild = self.guild
+        if not guild or not self.channel_id:
+            return None
+        channel = guild.get_channel(self.channel_id)
+        return channel if isinstance(channel, discord.VoiceChannel) else None
+
+    @property
+    def voice_client(self):
+        guild = self.guild
+        return guild.voice_client if guild else None
+
+    @property
+    def source(self):
+        voice_client = self.voice_client
+        return voice_client.source if voice_client else None
+
+class PlayerManager:
+    """Holds one GuildPlayer per guild, looked up by guild id"""
+    def __init__(self):
+        self._players = {}
+
+    def get(self, guild_id):
+        """Return the guild's player, creating it on first use"""
+        player = self._players.get(guild_id)
+        if player is None:
+            player = self._players[guild_id] = GuildPlayer(guild_id)
+        return player
+
+    def find(self, guild_id):
+        """Return the guild's player, or None if the guild has never used the bot"""
+        return self._players.get(guild_id)
+
+    def designated(self):
+        """Players that have a designated channel"""
+        return [player for player in self._players.values() if player.channel_id]
+
+    def __iter__(self):
+        return iter(list(self._players.values()))
+
+    def __len__(self):
+        return len(self._players)
+
+players = PlayerManager()
+if TARGET_GUILD_ID and TARGET_CHANNEL_ID:
+    players.get(TARGET_GUILD_ID).channel_id = TARGET_CHANNEL_ID
+
+async def start_playback(player, station, *, owner=None, recovering=False):
+    """Resolve a station and start it on the guild's voice client.
+
+    If something is already playing and GAPLESS_SWITCH is on, the new stream is buffered
+    while the old one keeps playing and then swapped in. Returns ``'extracted'`` or
+    ``'direct'`` depending on how the stream was opened, and records the switch latency
+    on the player. Raises ``asyncio.CancelledError`` if newer playback was requested
+    while this one was resolving.
+    """
+    url = catalog.get(station).url
+    switch_started = time.monotonic()
+    previous_station = player.station
+    generation = player.supervisor.begin(recovering=recovering)
+    
+    voice_client = player.voice_client
+    gapless = GAPLESS_SWITCH and voice_client.is_playing() and voice_client.source is not None
+    if not gapless and (voice_client.is_playing() or voice_client.is_paused()):
+        # Stop current playback
+        voice_client.stop()
     
-    # US Stations
-    'kexp': 'https://kexp-mp3-128.streamguys1.com/kexp128.mp3',
-    'npr': 'https://nprdmp.ic.llnwd.net/stream/nprdmp_live01_mp3',
-    'kiis': 'https://playerservices.streamtheworld.com/api/livestream-redirect/KIISFMAAC.aac',
+    try:
+        source = await YTDLSource.from_url(url, loop=bot.loop, stream=True, cache_key=station, owner=owner, volume=player.volume)
+        via = 'direct' if source.data.get('direct') else 'extracted'
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        # Fallback: try direct stream
+        source = await create_station_source(station, {'url': url}, player.volume)
+        via = 'direct'
     
-    # European Stations
-    'radio1': 'http://bbcmedia.ic.llnwd.net/stream/bbcmedia_radio1_mf_p',
-    'nrj': 'http://cdn.nrjaudio.fm/audio1/fr/30001/mp3_128.mp3',
+    voice_client = player.voice_client
+    if not player.supervisor.is_current(generation) or voice_client is None:
+        source.cleanup()
+        raise asyncio.CancelledError()
     
-    # Indian Stations
-    'radiocity': 'http://prclive1.listenon.in:9960',
-    'redFM': 'http://air.pc.cdn.bitgravity.com/air/live/pbaudio043/playlist.m3u8',
+    if gapless and voice_client.is_playing():
+        try:
+            started = await bot.loop.run_in_executor(None, prime_source, source, SWITCH_PREBUFFER_FRAMES, SWITCH_PREBUFFER_TIMEOUT)
+        except BaseException:
+            source.cleanup()
+            raise
+        if not player.supervisor.is_current(generation):
+            source.cleanup()
+            raise asyncio.CancelledError()
+        if not started:
+            source.cleanup()
+            # Keep supervising the station that is still on air
+            player.supervisor.retarget(previous_station, generation)
+            raise RuntimeError(f"{station} didn't produce any audio")
+        if voice_client.is_playing():
+            swap_source(voice_client, source)
+            player.supervisor.retarget(station, generation)
+            player.station = station
+            player.last_switch_latency = time.monotonic() - switch_started
+            metric_time_to_first_audio.observe(player.last_switch_latency, path='gapless')
+            player.save()
+            return via
     
-    # Add more stations as needed
-}
+    if voice_client.is_playing() or voice_client.is_paused():
+        voice_client.stop()
+    source.monitor.expect_first_audio(switch_started)
+    voice_client.play(source, after=player.supervisor.after_callback(station, generation))
+    player.station = station
+    player.last_switch_latency = time.monotonic() - switch_started
+    player.save()
+    return via
 
-# YTDL options for radio streaming
-ytdl_format_options = {
-    'format': 'bestaudio/best',
-    'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
-    'restrictfilenames': True,
-    'noplaylist': True,
-    'nocheckcertificate': True,
-    'ignoreerrors': False,
-    'logtostderr': False,
-    'quiet': True,
-    'no_warnings': True,
-    'default_search': 'auto',
-    'source_address': '0.0.0.0'
-}
+def swap_source(voice_client, source):
+    """Replace the playing source in place, crossfading when both sides are PCM"""
+    current = voice_client.source
+    if not voice_client.encoder and not source.is_opus():
+        # The voice client only creates an encoder when playback starts on a PCM source (it is MISSING until then)
+        voice_client.encoder = discord.opus.Encoder()
+    
+    if SWITCH_CROSSFADE_FRAMES and not current.is_opus() and not source.is_opus():
+        def finished(crossfade):
+            # Drop the wrapper once the fade is over so later swaps see the real source
+            def unwrap():
+                if voice_client.source is crossfade:
+                    voice_client.source = crossfade.release()
+            bot.loop.call_soon_threadsafe(unwrap)
+        
+        voice_client.source = CrossfadeSource(current, source, SWITCH_CROSSFADE_FRAMES, finished)
+        return
+    
+    voice_client.source = source
+    # The voice thread may still be mid-read on the old source, and killing FFmpeg can block
+    bot.loop.call_later(0.5, bot.loop.run_in_executor, None, current.cleanup)
 
-ffmpeg_options = {
-    'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
-    'options': '-vn'
-}
+metric_active_streams.collect_with(lambda: {
+    (('guild', player.guild_id),): 1 for player in players
+    if player.voice_client and player.voice_client.is_playing()})
+metric_worker_streams.collect_with(lambda: {
+    (('worker', worker.index),): len(worker.sources) for worker in list(audio_workers.workers)})
+metric_broadcast_listeners.collect_with(lambda: {
+    (('path', key[1]), ('station', key[0])): broadcast.listeners
+    for key, broadcast in list(broadcast_hub._broadcasts.items())})
 
-ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
+async def start_metrics_server():
+    """Serve the metrics registry at /metrics on METRICS_HOST:METRICS_PORT"""
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Prometheus-Format': '0.0.4'})
+    
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    print(f'📈 Metrics available at http://{METRICS_HOST}:{METRICS_PORT}/metrics')
 
-class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=0.5):
-        super().__init__(source, volume)
-        self.data = data
-        self.title = data.get('title')
-        self.url = data.get('url')
+# Command responses
+class ChannelBudget:
+    """Sliding-window count of messages sent or edited in each channel"""
+    def __init__(self, limit, window):
+        self.limit = limit
+        self.window = window
+        self._spent = {}  # channel id -> deque of monotonic timestamps
 
-    @classmethod
-    async def from_url(cls, url, *, loop=None, stream=False):
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
-        
-        if 'entries' in data:
-            data = data['entries'][0]
-        
-        filename = data['url'] if stream else ytdl.prepare_filename(data)
-        return cls(discord.FFmpegPCMAudio(filename, **ffmpeg_options), data=data)
+    def remaining(self, channel_id):
+        spent = self._spent.get(channel_id)
+        if not spent:
+            return self.limit
+        cutoff = time.monotonic() - self.window
+        while spent and spent[0] <= cutoff:
+            spent.popleft()
+        if not spent:
+            del self._spent[channel_id]
+            return self.limit
+        return self.limit - len(spent)
+
+    def try_spend(self, channel_id, reserve=0):
+        """Use one message of budget if more than ``reserve`` is left"""
+        if self.remaining(channel_id) <= reserve:
+            return False
+        self._spent.setdefault(channel_id, deque()).append(time.monotonic())
+        return True
+
+    async def spend(self, channel_id):
+        """Wait until the channel has budget left, then use it"""
+        while not self.try_spend(channel_id):
+            oldest = self._spent[channel_id][0]
+            await asyncio.sleep(max(0.05, oldest + self.window - time.monotonic()))
+
+class CommandReply:
+    """A command's status message: the first update sends it and later ones edit it in place.
+    
+    Updates arriving faster than RESPONSE_EDIT_INTERVAL are coalesced into a single edit, and
+    whatever is still pending goes out when the reply is closed.
+    """
+    def __init__(self, manager, target, channel_id):
+        self.manager = manager
+        self.target = target  # Anything with send(), usually the command context
+        self.channel_id = channel_id
+        self.message = None
+        self.lines = []
+        self._sent = None
+        self._last_edit = 0
+        self._flush_task = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def content(self):
+        return '\n'.join(self.lines)
+
+    async def update(self, content):
+        """Replace the latest line, e.g. a loading notice with its result"""
+        if self.lines:
+            self.lines[-1] = content
+        else:
+            self.lines.append(content)
+        await self._changed()
+
+    async def add(self, content):
+        """Show another line below the existing ones"""
+        self.lines.append(content)
+        await self._changed()
+
+    async def _changed(self):
+        if self.message is None and not self._lock.locked():
+            # The first update goes out straight away so the user sees the command was picked up
+            await self.flush()
+        elif self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_later())
+        else:
+            metric_responses.inc(outcome='coalesced')
+
+    async def _flush_later(self):
+        await asyncio.sleep(max(0, self._last_edit + RESPONSE_EDIT_INTERVAL - time.monotonic()))
+        self._flush_task = None
+        # Shielded so closing the reply can't interrupt a send or edit halfway through
+        await asyncio.shield(self.flush())
+
+    async def flush(self):
+        async with self._lock:
+            content = self.content
+            if not content or content == self._sent:
+                return
+            await self.manager.budget.spend(self.channel_id)
+            if self.message is None:
+                self.message = await self.target.send(content)
+                metric_responses.inc(outcome='sent')
+            else:
+                await self.message.edit(content=content)
+                metric_responses.inc(outcome='edited')
+            self._sent = content
+            self._last_edit = time.monotonic()
+
+    async def close(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        await self.flush()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+class ErrorReply(str):
+    """A shared command helper's reply that reports a failure, so prefix commands de-duplicate it"""
+
+class ResponseManager:
+    """Sends command output within each channel's rate budget and drops repeated error replies"""
+    def __init__(self):
+        self.budget = ChannelBudget(CHANNEL_MESSAGE_BUDGET, CHANNEL_BUDGET_WINDOW)
+        self._recent_errors = {}  # (user id, channel id, message) -> monotonic time it was last sent
+
+    def reply(self, ctx):
+        """A coalescing status message for one command, best used as ``async with``"""
+        return CommandReply(self, ctx, ctx.channel.id)
+
+    async def send(self, ctx, content=None, **kwargs):
+        await self.budget.spend(ctx.channel.id)
+        metric_responses.inc(outcome='sent')
+        return await ctx.send(content, **kwargs)
+
+    async def error(self, ctx, content):
+        """Reply with an error unless this user just got the same one here or the channel is short on budget"""
+        now = time.monotonic()
+        key = (ctx.author.id, ctx.channel.id, content)
+        last = self._recent_errors.get(key)
+        # Errors give way to real output, so they never wait for budget and leave some for command replies
+        if (last is not None and now - last < ERROR_REPLY_WINDOW) or \
+                not self.budget.try_spend(ctx.channel.id, reserve=ERROR_REPLY_RESERVE):
+            metric_responses.inc(outcome='suppressed')
+            return None
+
+        if len(self._recent_errors) > 256:
+            self._recent_errors = {k: t for k, t in self._recent_errors.items() if now - t < ERROR_REPLY_WINDOW}
+        self._recent_errors[key] = now
+        metric_responses.inc(outcome='sent')
+        return await ctx.send(content)
+
+    async def result(self, ctx, content):
+        """Send a shared command helper's reply, as an error if it is an ErrorReply"""
+        if isinstance(content, ErrorReply):
+            return await self.error(ctx, content)
+        return await self.send(ctx, content)
+
+responses = ResponseManager()
 
 # Bot events
+@bot.event
+async def setup_hook():
+    try:
+        state_store.open()
+        state_store.restore(players, stream_cache)
+    except sqlite3.Error as e:
+        print(f'❌ Could not open saved state, starting fresh: {e}')
+    if AUDIO_WORKERS:
+        await bot.loop.run_in_executor(None, audio_workers.start)
+    refresh_stream_cache.start()
+    reload_catalog.start()
+    if PROBE_ON_STARTUP:
+        probe_stations.start()
+    if METRICS_PORT:
+        try:
+            await start_metrics_server()
+        except OSError as e:
+            print(f'❌ Could not start metrics endpoint: {e}')
+    if SLASH_COMMANDS:
+        try:
+            synced = await bot.tree.sync()
+            print(f'Synced {len(synced)} slash commands')
+        except discord.HTTPException as e:
+            print(f'❌ Could not sync slash commands: {e}')
+
 @bot.event
 async def on_ready():
     print(f'{bot.user} has connected to Discord!')
     print(f'Bot is in {len(bot.guilds)} guilds')
+
+    # Auto-join every designated voice channel and resume what each guild was playing, all at once
+    await asyncio.gather(*(restore_guild(player) for player in players))
+
+    print(f'🤖 Bot is ready! {len(players.designated())} guild(s) have a designated channel.')
+
+async def restore_guild(player):
+    if AUTO_JOIN_ON_STARTUP and player.channel_id:
+        await auto_join_designated_channel(player)
+    if RESUME_ON_STARTUP and player.resume_station:
+        await resume_playback(player)
+
+async def resume_playback(player):
+    """Restart the station a guild was playing before the bot restarted"""
+    # on_ready fires again after gateway reconnects, only resume once
+    station, player.resume_station = player.resume_station, None
+    if station not in catalog:
+        return
+    channel = player.channel or bot.get_channel(player.resume_channel_id)
+    if not isinstance(channel, discord.VoiceChannel):
+        return
     
-    # Auto-join the designated voice channel
-    if AUTO_JOIN_ON_STARTUP and TARGET_GUILD_ID and TARGET_CHANNEL_ID:
-        try:
-            guild = bot.get_guild(TARGET_GUILD_ID)
-            if guild:
-                channel = guild.get_channel(TARGET_CHANNEL_ID)
-                if channel and isinstance(channel, discord.VoiceChannel):
-                    # Check if already connected to this channel
-                    voice_client = guild.voice_client
-                    if not voice_client or voice_client.channel.id != TARGET_CHANNEL_ID:
-                        if voice_client:
-                            await voice_client.disconnect()
-                        await channel.connect()
-                        print(f'🎵 Auto-joined voice channel: {channel.name}')
-                    else:
-                        print(f'🎵 Already connected to target channel: {channel.name}')
-                else:
-                    print(f'❌ Target channel not found or not a voice channel')
-            else:
-                print(f'❌ Target guild not found')
-        except Exception as e:
-            print(f'❌ Error auto-joining channel: {e}')
-    
-    print('🤖 Bot is ready and configured for single-channel operation!')
+    try:
+        await player.connection.connect(channel)
+        via = await start_playback(player, station, owner=player.guild_id)
+        print(f'▶️ Resumed {station} in {channel.name} ({via}, {player.last_switch_latency:.2f}s)')
+    except asyncio.CancelledError:
+        pass  # Someone picked another station while it was resolving
+    except Exception as e:
+        print(f'❌ Could not resume {station} in guild {player.guild_id}: {e}')
+
+async def auto_join_designated_channel(player):
+    """Join a guild's designated channel on startup"""
+    try:
+        if not player.guild:
+            print(f'❌ Target guild {player.guild_id} not found')
+            return
+
+        channel = player.channel
+        if not channel:
+            print(f'❌ Target channel not found or not a voice channel in {player.guild.name}')
+            return
+
+        # Check if already connected to this channel
+        voice_client = player.voice_client
+        if voice_client and voice_client.is_connected() and voice_client.channel.id == player.channel_id:
+            print(f'🎵 Already connected to target channel: {channel.name}')
+            return
+        await player.connection.connect(channel)
+        print(f'🎵 Auto-joined voice channel: {channel.name}')
+    except Exception as e:
+        print(f'❌ Error auto-joining channel: {e}')
 
 @bot.event
 async def on_voice_state_update(member, before, after):
     """Ensure bot stays in the designated channel"""
+    player = players.find(member.guild.id)
+    if not player or not player.channel_id:
+        return
+
     if member == bot.user:
+        # Our own connection was dropped (kicked, channel deleted or the voice server went away)
+        if before.channel and after.channel is None:
+            player.connection.schedule_rejoin()
         return
-    
-    # If bot gets disconnected, try to rejoin the target channel
-    if bot.voice_clients:
-        voice_client = bot.voice_clients[0]
-        if not voice_client.is_connected():
-            await auto_rejoin_target_channel()
-
-async def auto_rejoin_target_channel():
-    """Automatically rejoin the target channel if disconnected"""
-    if TARGET_GUILD_ID and TARGET_CHANNEL_ID:
-        try:
-            guild = bot.get_guild(TARGET_GUILD_ID)
-            if guild:
-                channel = guild.get_channel(TARGET_CHANNEL_ID)
-                if channel and isinstance(channel, discord.VoiceChannel):
-                    await channel.connect()
-                    print(f'🔄 Reconnected to target channel: {channel.name}')
-        except Exception as e:
-            print(f'❌ Error rejoining target channel: {e}')
+
+    # Other members' events are only a cue to notice a connection that broke silently
+    voice_client = player.voice_client
+    if voice_client and not voice_client.is_connected() and player.connection.state == VoiceConnection.DISCONNECTED:
+        player.connection.schedule_rejoin()
 
 @bot.event
 async def on_command_error(ctx, error):
     if isinstance(error, commands.MissingRequiredArgument):
-        await ctx.send("❌ Missing required argument. Use `!help` for command usage.")
+        await responses.error(ctx, "❌ Missing required argument. Use `!help` for command usage.")
     elif isinstance(error, commands.CommandNotFound):
-        await ctx.send("❌ Unknown command. Use `!help` to see available commands.")
+        await responses.error(ctx, "❌ Unknown command. Use `!help` to see available commands.")
+    elif isinstance(error, commands.NoPrivateMessage):
+        await responses.error(ctx, "❌ Radio commands only work inside a server.")
     else:
-        await ctx.send(f"❌ An error occurred: {str(error)}")
+        await responses.error(ctx, f"❌ An error occurred: {str(error)}")
         print(f"Error: {error}")
 
+@bot.before_invoke
+async def start_command_timer(ctx):
+    ctx.command_started = time.perf_counter()
+
+@bot.after_invoke
+async def record_command_latency(ctx):
+    started = getattr(ctx, 'command_started', None)
+    if started is not None:
+        metric_command_seconds.observe(time.perf_counter() - started, command=ctx.command.qualified_name)
+
+@bot.check
+async def guild_only(ctx):
+    """Every radio command needs a guild to route to"""
+    if ctx.guild is None:
+        raise commands.NoPrivateMessage()
+    return True
+
 # Utility function to check if user is in the target channel
 def is_in_target_channel(ctx):
-    """Check if the user is in the designated voice channel"""
-    if not TARGET_CHANNEL_ID:
+    """Check if the user is in the guild's designated voice channel"""
+    return member_in_target_channel(players.get(ctx.guild.id), ctx.author)
+
+def member_in_target_channel(player, member):
+    if not player.channel_id:
         return True  # If no target channel set, allow from anywhere
-    
-    if not ctx.author.voice:
+
+    if not member.voice:
         return False
-    
-    return ctx.author.voice.channel.id == TARGET_CHANNEL_ID
 
-def is_bot_in_target_channel(ctx):
-    """Check if bot is connected to the target channel"""
-    if not TARGET_CHANNEL_ID:
-        return bool(ctx.voice_client)
-    
-    return (ctx.voice_client and 
-            ctx.voice_client.channel and 
-            ctx.voice_client.channel.id == TARGET_CHANNEL_ID)
+    return member.voice.channel.id == player.channel_id
 
 # Radio commands
 @bot.command(name='join', help='Make the bot join the designated voice channel')
 async def join(ctx):
+    player = players.get(ctx.guild.id)
+
     # If target channel is configured, ignore user's channel and join target
-    if TARGET_GUILD_ID and TARGET_CHANNEL_ID:
-        guild = bot.get_guild(TARGET_GUILD_ID)
-        if not guild:
-            await ctx.send("❌ Target server not found!")
-            return
-        
-        channel = guild.get_channel(TARGET_CHANNEL_ID)
-        if not channel or not isinstance(channel, discord.VoiceChannel):
-            await ctx.send("❌ Target voice channel not found!")
+    if player.channel_id:
+        channel = player.channel
+        if not channel:
+            await responses.error(ctx, "❌ Target voice channel not found!")
             return
-        
+
         # Check if already connected to target channel
-        if ctx.voice_client and ctx.voice_client.channel.id == TARGET_CHANNEL_ID:
-            await ctx.send(f"✅ Already connected to {channel.name}")
+        if ctx.voice_client and ctx.voice_client.channel.id == player.channel_id:
+            await responses.send(ctx, f"✅ Already connected to {channel.name}")
             return
-        
-        # Disconnect from any other channel first
-        if ctx.voice_client:
-            await ctx.voice_client.disconnect()
-        
-        await channel.connect()
-        await ctx.send(f"🎵 Joined designated channel: **{channel.name}**")
+
+        await player.connection.connect(channel)
+        await responses.send(ctx, f"🎵 Joined designated channel: **{channel.name}**")
         return
-    
+
     # Fallback to original behavior if no target channel configured
     if not ctx.author.voice:
-        await ctx.send("❌ You need to be in a voice channel, or configure TARGET_CHANNEL_ID!")
+        await responses.error(ctx, "❌ You need to be in a voice channel, or use `!setchannel` to designate one!")
         return
-    
+
     channel = ctx.author.voice.channel
-    if ctx.voice_client is not None:
-        return await ctx.voice_client.move_to(channel)
-    
-    await channel.connect()
-    await ctx.send(f"🎵 Joined {channel}")
+    await player.connection.connect(channel)
+    await responses.send(ctx, f"🎵 Joined {channel}")
 
-@bot.command(name='leave', help='Make the bot leave the voice channel (will auto-rejoin if configured)')
+@bot.command(name='leave', help='Make the bot leave the voice channel (stays in the designated channel if auto-join is on)')
 async def leave(ctx):
-    if ctx.voice_client:
-        await ctx.voice_client.disconnect()
-        await ctx.send("👋 Left the voice channel")
-        
-        # Auto-rejoin if configured
-        if AUTO_JOIN_ON_STARTUP and TARGET_CHANNEL_ID:
-            await asyncio.sleep(2)  # Brief delay
-            await auto_rejoin_target_channel()
-            await ctx.send("🔄 Auto-rejoined designated channel")
-    else:
-        await ctx.send("❌ Not connected to a voice channel")
+    player = players.get(ctx.guild.id)
+    if not ctx.voice_client:
+        await responses.error(ctx, "❌ Not connected to a voice channel")
+        return
+
+    player.supervisor.cancel()
+    player.station = None
+
+    # Leaving would only be followed by an auto-rejoin, so stop (or move back) without a new handshake
+    channel = player.channel
+    if AUTO_JOIN_ON_STARTUP and channel:
+        ctx.voice_client.stop()
+        if ctx.voice_client.channel.id != channel.id:
+            await player.connection.connect(channel)
+            player.save()
+            await responses.send(ctx, f"🔄 Stopped and moved back to the designated channel **{channel.name}**")
+        else:
+            player.save()
+            await responses.send(ctx, f"⏹️ Stopped the radio, staying in the designated channel **{channel.name}**")
+        return
+
+    await player.connection.disconnect()
+    player.save()
+    await responses.send(ctx, "👋 Left the voice channel")
 
 @bot.command(name='play', help='Play a radio station (!play <station_name>)')
 async def play(ctx, *, station=None):
     if not station:
-        await ctx.send("❌ Please specify a station. Use `!stations` to see available options.")
+        await responses.error(ctx, "❌ Please specify a station. Use `!stations` to see available options.")
         return
-    
+
+    async with responses.reply(ctx) as reply:
+        await play_station(players.get(ctx.guild.id), ctx.author, station, reply.update, ctx.channel.id)
+
+async def play_station(player, member, query, report, channel_id):
+    """Shared !play and /play logic; ``report`` is awaited with each status message"""
     # Check if target channel is configured and enforce it
-    if TARGET_CHANNEL_ID:
-        if not is_in_target_channel(ctx):
-            channel_name = "the designated channel"
-            if TARGET_GUILD_ID:
-                guild = bot.get_guild(TARGET_GUILD_ID)
-                if guild:
-                    channel = guild.get_channel(TARGET_CHANNEL_ID)
-                    if channel:
-                        channel_name = f"**{channel.name}**"
-            await ctx.send(f"❌ You need to be in {channel_name} to control the radio!")
+    if player.channel_id:
+        if not member_in_target_channel(player, member):
+            channel = player.channel
+            channel_name = f"**{channel.name}**" if channel else "the designated channel"
+            await report(f"❌ You need to be in {channel_name} to control the radio!")
             return
-        
-        # Ensure bot is in target channel
-        if not is_bot_in_target_channel(ctx):
-            await ctx.invoke(join)
-    else:
+    elif not member.voice:
         # Original behavior if no target channel configured
-        if not ctx.author.voice:
-            await ctx.send("❌ You need to be in a voice channel!")
-            return
-        
-        if not ctx.voice_client:
-            await ctx.invoke(join)
-    
-    station_lower = station.lower()
-    if station_lower not in RADIO_STATIONS:
-        await ctx.send(f"❌ Station '{station}' not found. Use `!stations` to see available stations.")
+        await report("❌ You need to be in a voice channel!")
         return
-    
-    url = RADIO_STATIONS[station_lower]
-    
+
+    match = catalog.resolve(query)
+    if match is None:
+        suggestions = catalog.search(query, limit=3)
+        hint = f" Did you mean {', '.join(f'`{s.name}`' for s in suggestions)}?" if suggestions else ""
+        await report(f"❌ Station '{query}' not found.{hint} Use `!stations` to see available stations.")
+        return
+    station = match.name
+
+    error = await ensure_voice(player, member)
+    if error:
+        await report(error)
+        return
+
+    player.announce_channel_id = channel_id
+
     try:
-        # Stop current playback
-        if ctx.voice_client.is_playing():
-            ctx.voice_client.stop()
-        
-        await ctx.send(f"🔄 Loading station: {station}...")
-        
+        await report(f"🔄 Loading station: {station}...")
+
         # Try to play the radio stream
         try:
-            player = await YTDLSource.from_url(url, loop=bot.loop, stream=True)
-            ctx.voice_client.play(player, after=lambda e: print(f'Player error: {e}') if e else None)
-            await ctx.send(f"🎵 Now playing: **{station.upper()}**")
-        except Exception as e:
-            # Fallback: try direct stream
-            source = discord.FFmpegPCMAudio(url, **ffmpeg_options)
-            ctx.voice_client.play(source, after=lambda e: print(f'Player error: {e}') if e else None)
-            await ctx.send(f"🎵 Now playing: **{station.upper()}** (direct stream)")
-    
+            via = await start_playback(player, match.key, owner=player.guild_id)
+        except asyncio.CancelledError:
+            # A newer !play in this server replaced this one while it was resolving
+            await report(f"⏭️ Skipped **{station.upper()}**, a newer station was requested")
+            return
+
+        note = f"(direct stream, {player.last_switch_latency:.2f}s)" if via == 'direct' else f"({player.last_switch_latency:.2f}s)"
+        await report(f"🎵 Now playing: **{station.upper()}** {note}")
+
     except Exception as e:
-        await ctx.send(f"❌ Error playing station: {str(e)}")
+        await report(f"❌ Error playing station: {str(e)}")
         print(f"Play error: {e}")
 
+async def ensure_voice(player, member):
+    """Connect to the designated channel (or the member's) for playback, returning an error message on failure"""
+    if player.channel_id:
+        channel = player.channel
+        if not channel:
+            return "❌ Target voice channel not found!"
+    elif player.voice_client:
+        return None
+    else:
+        channel = member.voice.channel
+
+    try:
+        await player.connection.connect(channel)
+    except (asyncio.TimeoutError, discord.DiscordException, OSError) as e:
+        # Already retried with backoff, and a deferred /play must still get an answer
+        return f"❌ Couldn't connect to **{channel.name}**: {str(e) or type(e).__name__}"
+    return None
+
 # Control commands with channel restrictions
 @bot.command(name='stop', help='Stop the current radio stream')
 async def stop(ctx):
-    if TARGET_CHANNEL_ID and not is_in_target_channel(ctx):
-        await ctx.send("❌ You need to be in the designated channel to control the radio!")
-        return
-    
-    if ctx.voice_client and ctx.voice_client.is_playing():
-        ctx.voice_client.stop()
-        await ctx.send("⏹️ Stopped the radio")
-    else:
-        await ctx.send("❌ Nothing is playing")
+    await responses.result(ctx, stop_station(players.get(ctx.guild.id), ctx.author))
+
+def stop_station(player, member):
+    """Shared !stop and /stop logic, returning the reply (an ErrorReply on failure)"""
+    if not member_in_target_channel(player, member):
+        return ErrorReply("❌ You need to be in the designated channel to control the radio!")
+
+    voice_client = player.voice_client
+    playing = voice_client is not None and voice_client.is_playing()
+    # Between a drop and the restart nothing plays, but the supervisor would still bring the station back
+    if not playing and player.station is None and not player.supervisor.recovering:
+        return ErrorReply("❌ Nothing is playing")
+
+    player.supervisor.cancel()
+    if voice_client:
+        voice_client.stop()
+    player.station = None
+    player.save()
+    return "⏹️ Stopped the radio"
 
 @bot.command(name='pause', help='Pause the radio stream')
 async def pause(ctx):
-    if TARGET_CHANNEL_ID and not is_in_target_channel(ctx):
-        await ctx.send("❌ You need to be in the designated channel to control the radio!")
+    if not is_in_target_channel(ctx):
+        await responses.error(ctx, "❌ You need to be in the designated channel to control the radio!")
         return
-    
+
     if ctx.voice_client and ctx.voice_client.is_playing():
         ctx.voice_client.pause()
-        await ctx.send("⏸️ Paused the radio")
+        await responses.send(ctx, "⏸️ Paused the radio")
     else:
-        await ctx.send("❌ Nothing is playing")
+        await responses.error(ctx, "❌ Nothing is playing")
 
 @bot.command(name='resume', help='Resume the radio stream')
 async def resume(ctx):
-    if TARGET_CHANNEL_ID and not is_in_target_channel(ctx):
-        await ctx.send("❌ You need to be in the designated channel to control the radio!")
+    if not is_in_target_channel(ctx):
+        await responses.error(ctx, "❌ You need to be in the designated channel to control the radio!")
         return
-    
+
     if ctx.voice_client and ctx.voice_client.is_paused():
         ctx.voice_client.resume()
-        await ctx.send("▶️ Resumed the radio")
+        await responses.send(ctx, "▶️ Resumed the radio")
     else:
-        await ctx.send("❌ Nothing is paused")
+        await responses.error(ctx, "❌ Nothing is paused")
 
 @bot.command(name='volume', help='Change volume (0-100)')
 async def volume(ctx, volume: int = None):
-    if TARGET_CHANNEL_ID and not is_in_target_channel(ctx):
-        await ctx.send("❌ You need to be in the designated channel to control the radio!")
-        return
-    
-    if not ctx.voice_client:
-        await ctx.send("❌ Not connected to a voice channel")
-        return
-    
+    await responses.result(ctx, await set_volume(players.get(ctx.guild.id), ctx.author, volume))
+
+async def set_volume(player, member, volume):
+    """Shared !volume and /volume logic, returning the reply (an ErrorReply on failure)"""
+    if not member_in_target_channel(player, member):
+        return ErrorReply("❌ You need to be in the designated channel to control the radio!")
+
+    voice_client = player.voice_client
+    if not voice_client:
+        return ErrorReply("❌ Not connected to a voice channel")
+
     if volume is None:
-        current_volume = int(ctx.voice_client.source.volume * 100) if hasattr(ctx.voice_client.source, 'volume') else 50
-        await ctx.send(f"🔊 Current volume: {current_volume}%")
-        return
-    
+        return f"🔊 Current volume: {int(player.volume * 100)}%"
+
     if not 0 <= volume <= 100:
-        await ctx.send("❌ Volume must be between 0 and 100")
-        return
+        return ErrorReply("❌ Volume must be between 0 and 100")
+
+    # Remembered per guild so the next station starts at the same level
+    player.volume = volume / 100
+    player.save()
+    source = voice_client.source
+    wanted_path = audio_path(player.volume)
+    if source is not None and getattr(source, 'path', wanted_path) != wanted_path:
+        if await switch_audio_path(player):
+            return f"🔊 Volume set to {volume}% (switched to {AUDIO_PATH_NAMES[wanted_path]} path)"
+        return f"🔊 Volume set to {volume}%, it applies from the next station (the {AUDIO_PATH_NAMES[wanted_path]} path didn't start)"
+
+    if hasattr(source, 'volume'):
+        source.volume = player.volume
+    return f"🔊 Volume set to {volume}%"
+
+async def switch_audio_path(player):
+    """Swap the playing source onto the path its volume calls for without stopping playback.
+
+    Returns False if the new path produced no audio and the old one was kept.
+    """
+    voice_client = player.voice_client
+    current = voice_client.source if voice_client else None
+    if current is None:
+        return False
     
-    if hasattr(ctx.voice_client.source, 'volume'):
-        ctx.voice_client.source.volume = volume / 100
-        await ctx.send(f"🔊 Volume set to {volume}%")
-    else:
-        await ctx.send("❌ Cannot adjust volume for this stream")
+    source = await create_station_source(player.station, current.data, player.volume)
+    try:
+        started = await bot.loop.run_in_executor(None, prime_source, source, SWITCH_PREBUFFER_FRAMES, SWITCH_PREBUFFER_TIMEOUT)
+    except BaseException:
+        source.cleanup()
+        raise
+    if voice_client.source is not current:
+        source.cleanup()  # Playback changed while the new path was buffering, and started at this volume
+        return True
+    if not started:
+        source.cleanup()
+        return False
+    
+    paused = voice_client.is_paused()
+    swap_source(voice_client, source)
+    if paused:
+        voice_client.pause()  # Setting the source resumes the player
+    return True
 
 # Add channel configuration commands
 @bot.command(name='setchannel', help='Set the designated voice channel (Admin only)')
 @commands.has_permissions(administrator=True)
 async def set_channel(ctx):
-    global TARGET_CHANNEL_ID, TARGET_GUILD_ID
-    
     if not ctx.author.voice:
-        await ctx.send("❌ You need to be in the voice channel you want to set as target!")
+        await responses.error(ctx, "❌ You need to be in the voice channel you want to set as target!")
         return
-    
-    TARGET_CHANNEL_ID = ctx.author.voice.channel.id
-    TARGET_GUILD_ID = ctx.guild.id
-    
-    await ctx.send(f"✅ Set **{ctx.author.voice.channel.name}** as the designated radio channel!")
-    await ctx.send("🔄 Bot will now auto-join this channel and restrict controls to users in this channel.")
-    
-    # Auto-join the newly set channel
-    if ctx.voice_client and ctx.voice_client.channel.id != TARGET_CHANNEL_ID:
-        await ctx.voice_client.move_to(ctx.author.voice.channel)
-    elif not ctx.voice_client:
-        await ctx.author.voice.channel.connect()
-    
-    await ctx.send(f"🎵 Joined **{ctx.author.voice.channel.name}**")
+
+    player = players.get(ctx.guild.id)
+    player.channel_id = ctx.author.voice.channel.id
+
+    async with responses.reply(ctx) as reply:
+        await reply.add(f"✅ Set **{ctx.author.voice.channel.name}** as the designated radio channel!")
+        await reply.add("🔄 Bot will now auto-join this channel and restrict controls to users in this channel.")
+
+        # Auto-join the newly set channel
+        await player.connection.connect(ctx.author.voice.channel)
+        player.save()
+
+        await reply.add(f"🎵 Joined **{ctx.author.voice.channel.name}**")
 
 @bot.command(name='status', help='Show bot configuration status')
 async def status(ctx):
+    await responses.send(ctx, embed=status_embed(players.get(ctx.guild.id)))
+
+def status_embed(player):
+    """Shared !status and /status embed"""
     embed = discord.Embed(title="🤖 Bot Status", color=0x00ff00)
-    
-    if TARGET_GUILD_ID and TARGET_CHANNEL_ID:
-        guild = bot.get_guild(TARGET_GUILD_ID)
-        channel_name = "Unknown Channel"
-        if guild:
-            channel = guild.get_channel(TARGET_CHANNEL_ID)
-            if channel:
-                channel_name = channel.name
-        
+    voice_client = player.voice_client
+
+    if player.channel_id:
+        channel = player.channel
+        channel_name = channel.name if channel else "Unknown Channel"
+
         embed.add_field(name="📍 Designated Channel", value=f"**{channel_name}**", inline=False)
         embed.add_field(name="🔧 Mode", value="Single Channel Mode", inline=True)
         embed.add_field(name="🎵 Auto-Join", value="✅ Enabled" if AUTO_JOIN_ON_STARTUP else "❌ Disabled", inline=True)
     else:
         embed.add_field(name="🔧 Mode", value="Free Roam Mode", inline=False)
         embed.add_field(name="📍 Note", value="No designated channel set. Use `!setchannel` to configure.", inline=False)
-    
+
     # Voice connection status
-    if ctx.voice_client:
-        embed.add_field(name="🔊 Voice Status", value=f"Connected to **{ctx.voice_client.channel.name}**", inline=False)
-        if ctx.voice_client.is_playing():
-            embed.add_field(name="🎵 Playback", value="▶️ Playing", inline=True)
-        elif ctx.voice_client.is_paused():
+    if voice_client:
+        embed.add_field(name="🔊 Voice Status", value=f"Connected to **{voice_client.channel.name}**", inline=False)
+        if voice_client.is_playing():
+            embed.add_field(name="🎵 Playback", value=f"▶️ Playing **{(player.station or 'unknown').upper()}**", inline=True)
+            track = now_playing.get(player.station)
+            if track:
+                embed.add_field(name="🎶 Track", value=track[:1024], inline=True)
+        elif voice_client.is_paused():
             embed.add_field(name="🎵 Playback", value="⏸️ Paused", inline=True)
         else:
             embed.add_field(name="🎵 Playback", value="⏹️ Stopped", inline=True)
+        embed.add_field(name="🔊 Volume", value=f"{int(player.volume * 100)}%", inline=True)
+        if player.last_switch_latency is not None:
+            embed.add_field(name="⏱️ Last Switch", value=f"{player.last_switch_latency:.2f}s", inline=True)
+        if player.supervisor.restarts:
+            embed.add_field(name="🛟 Auto-Recoveries", value=f"{player.supervisor.restarts} (last outage {player.supervisor.last_outage:.1f}s)", inline=True)
+        source = voice_client.source
+        if source is not None:
+            embed.add_field(name="🎛️ Audio Path", value=AUDIO_PATH_NAMES[getattr(source, 'path', 'pcm')], inline=True)
+            buffer = find_jitter_buffer(source)
+            if buffer is not None:
+                embed.add_field(name="🧺 Jitter Buffer", value=f"{buffer.fill}/{buffer.target} frames ({buffer.target * FRAME_LENGTH * 1000:.0f} ms target) · {buffer.underruns} underruns", inline=True)
     else:
-        embed.add_field(name="🔊 Voice Status", value="Not connected", inline=False)
-    
-    await ctx.send(embed=embed)
-async def stations(ctx):
-    embed = discord.Embed(title="📻 Available Radio Stations", color=0x00ff00)
-    
-    global_stations = []
-    us_stations = []
-    eu_stations = []
-    indian_stations = []
+        state = player.connection.state
+        embed.add_field(name="🔊 Voice Status", value="Not connected" if state == VoiceConnection.DISCONNECTED else f"Not connected ({state})", inline=False)
+
+    return embed
+
+@bot.command(name='metrics', help='Show performance metrics (Admin only)')
+@commands.has_permissions(administrator=True)
+async def metrics_command(ctx):
+    embed = discord.Embed(title="📈 Radio Metrics", color=0x00ff00)
+
+    def latency(metric):
+        count = metric.total()
+        if not count:
+            return "No samples yet"
+        p50, p95 = metric.quantile(0.5), metric.quantile(0.95)
+        fmt = lambda value: f"≤{value * 1000:.0f} ms" if value != float('inf') else "slow"
+        return f"avg {metric.mean() * 1000:.0f} ms · p50 {fmt(p50)} · p95 {fmt(p95)} · {count} samples"
+
+    embed.add_field(name="🔎 Extraction", value=latency(metric_extraction_seconds), inline=False)
+    embed.add_field(name="📦 from_url", value=latency(metric_resolve_seconds), inline=False)
+    embed.add_field(name="⏱️ Time to First Audio", value=latency(metric_time_to_first_audio), inline=False)
+    embed.add_field(name="🎞️ FFmpeg", value=f"{metric_ffmpeg_processes.total()} running · {metric_ffmpeg_spawned.total()} started · {metric_stream_restarts.total()} auto-restarts", inline=False)
+    embed.add_field(name="📻 Streams", value=f"{metric_active_streams.total()} playing · {len(metric_broadcast_listeners.samples())} shared broadcasts", inline=True)
+    embed.add_field(name="📉 Frames", value=f"{metric_frame_underruns.total()} underruns · {metric_late_frames.total()} late", inline=True)
+    targets = list(metric_jitter_buffer_target.samples().values())
+    embed.add_field(name="🧺 Jitter Buffers", value=f"{len(live_jitter_buffers)} running · {max(targets, default=0)} frame peak target · {metric_jitter_buffer_rebuffers.total()} rebuffers · {metric_jitter_buffer_dropped.total()} frames dropped", inline=False)
+    replies = {dict(key)['outcome']: count for key, count in metric_responses.samples().items()}
+    embed.add_field(name="💬 Replies", value=" · ".join(f"{replies.get(outcome, 0)} {outcome}" for outcome in ('sent', 'edited', 'coalesced', 'suppressed')), inline=False)
+
+    commands_seen = sorted(metric_command_seconds.samples().items(), key=lambda item: -item[1][1] / item[1][2])[:5]
+    if commands_seen:
+        lines = [f"`{dict(key)['command']}` {entry[1] / entry[2] * 1000:.0f} ms avg ({entry[2]}x)" for key, entry in commands_seen]
+        embed.add_field(name="⌨️ Slowest Commands", value="\n".join(lines), inline=False)
+
+    if METRICS_PORT:
+        embed.set_footer(text=f"Prometheus endpoint: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    await responses.send(ctx, embed=embed)
+
+@bot.command(name='stations', help='List radio stations (!stations all includes offline ones, !stations <search> filters)')
+async def stations(ctx, *, show: str = None):
+    await responses.send(ctx, embed=stations_embed(show))
+
+def stations_embed(show=None):
+    """Shared !stations and /stations embed; ``show`` is 'all', a search term or None"""
+    show_all = show == 'all'
+    if show and not show_all:
+        listed = catalog.search(show, limit=20)
+        embed = discord.Embed(title=f"📻 Stations matching '{show}'", color=0x00ff00)
+    else:
+        listed = list(catalog)
+        embed = discord.Embed(title="📻 Available Radio Stations", color=0x00ff00)
     
-    station_regions = {
-        'bbc1': '🌍 Global', 'bbc2': '🌍 Global', 'cnn': '🌍 Global',
-        'kexp': '🇺🇸 US', 'npr': '🇺🇸 US', 'kiis': '🇺🇸 US',
-        'radio1': '🇪🇺 Europe', 'nrj': '🇪🇺 Europe',
-        'radiocity': '🇮🇳 India', 'redfm': '🇮🇳 India'
-    }
+    by_region = {}
+    hidden = 0
     
-    for station in RADIO_STATIONS.keys():
-        region = station_regions.get(station, '🌍 Global')
-        if '🌍' in region:
-            global_stations.append(f"`{station}` - {region}")
-        elif '🇺🇸' in region:
-            us_stations.append(f"`{station}` - {region}")
-        elif '🇪🇺' in region:
-            eu_stations.append(f"`{station}` - {region}")
-        elif '🇮🇳' in region:
-            indian_stations.append(f"`{station}` - {region}")
+    for station in listed:
+        result = station_prober.results.get(station.key)
+        if result and not result.ok and not show_all:
+            hidden += 1
+            continue
+        
+        line = f"`{station.name}`"
+        if station.title:
+            line += f" - {station.title}"
+        if result and result.ok:
+            line += f" · {result.codec or station.codec or '?'} · {int(result.latency * 1000)} ms"
+        elif result:
+            line = f"❌ {line} (offline)"
+        by_region.setdefault(station.region, []).append(line)
     
-    if global_stations:
-        embed.add_field(name="🌍 Global/International", value="\n".join(global_stations), inline=False)
-    if us_stations:
-        embed.add_field(name="🇺🇸 United States", value="\n".join(us_stations), inline=False)
-    if eu_stations:
-        embed.add_field(name="🇪🇺 Europe", value="\n".join(eu_stations), inline=False)
-    if indian_stations:
-        embed.add_field(name="🇮🇳 India", value="\n".join(indian_stations), inline=False)
+    # Known regions first in their usual order, then anything else the catalog defines
+    regions = [region for region in STATION_REGIONS if region in by_region]
+    regions += sorted(region for region in by_region if region not in STATION_REGIONS)
+    for region in regions[:20]:
+        lines = by_region[region]
+        value = ""
+        for i, line in enumerate(lines):
+            if len(value) + len(line) + 40 > 1024:  # Embed field limit
+                value += f"…and {len(lines) - i} more"
+                break
+            value += line + "\n"
+        embed.add_field(name=STATION_REGIONS.get(region, f"🌍 {region.title()}"), value=value, inline=False)
     
+    if not listed:
+        embed.add_field(name="No matches", value="Try a shorter search or `!stations` to list everything.", inline=False)
+    if hidden:
+        embed.add_field(name="Offline", value=f"{hidden} unreachable station(s) hidden. Use `!stations all` to show them.", inline=False)
     embed.add_field(name="Usage", value="Use `!play <station_name>` to play a station", inline=False)
-    await ctx.send(embed=embed)
+    return embed
+
+@bot.command(name='reloadstations', help='Reload the station catalog from disk (Admin only)')
+@commands.has_permissions(administrator=True)
+async def reload_stations(ctx):
+    try:
+        catalog.load()
+    except (OSError, ValueError, KeyError, sqlite3.Error) as e:
+        await responses.error(ctx, f"❌ Could not reload the station catalog: {e}")
+        return
+    await responses.send(ctx, f"✅ Reloaded {len(catalog)} stations")
 
 @bot.command(name='now', help='Show currently playing station info')
 async def now(ctx):
     if ctx.voice_client and ctx.voice_client.is_playing():
         source = ctx.voice_client.source
-        if hasattr(source, 'title') and source.title:
-            await ctx.send(f"🎵 Now playing: **{source.title}**")
+        player = players.get(ctx.guild.id)
+        name = getattr(source, 'title', None) or (player.station.upper() if player.station else None)
+        track = now_playing.get(player.station)
+        if name and track:
+            await responses.send(ctx, f"🎵 Now playing: **{name}**\n🎶 {track}")
+        elif name:
+            await responses.send(ctx, f"🎵 Now playing: **{name}**")
         else:
-            await ctx.send("🎵 Radio is currently playing")
+            await responses.send(ctx, "🎵 Radio is currently playing")
     else:
-        await ctx.send("❌ Nothing is playing")
+        await responses.error(ctx, "❌ Nothing is playing")
 
 # Help command override
 @bot.remove_command('help')
@@ -455,22 +2958,74 @@ async def help_command(ctx):
     
     commands_list = [
         ("`!join`", "Join your voice channel"),
-        ("`!leave`", "Leave the voice channel"),
+        ("`!leave`", "Leave the voice channel (just stops if a designated channel is set)"),
         ("`!play <station>`", "Play a radio station"),
         ("`!stop`", "Stop the radio"),
         ("`!pause`", "Pause the radio"),
         ("`!resume`", "Resume the radio"),
         ("`!volume <0-100>`", "Change volume or check current volume"),
-        ("`!stations`", "List all available stations"),
+        ("`!stations [all|search]`", "List stations (`all` includes offline ones, or search by name)"),
         ("`!now`", "Show current playing info"),
         ("`!help`", "Show this help message")
     ]
+    if SLASH_COMMANDS:
+        commands_list.append(("`/play` `/stop` `/volume` `/stations` `/status`", "Slash versions of the commands above, with station autocomplete"))
     
     for command, description in commands_list:
         embed.add_field(name=command, value=description, inline=False)
     
     embed.add_field(name="Example", value="`!play bbc1` - Play BBC Radio 1", inline=False)
-    await ctx.send(embed=embed)
+    await responses.send(ctx, embed=embed)
+
+# Slash commands
+# Registered on the tree only when enabled; they share their logic with the prefix commands above.
+# /play defers first because resolving a station can take longer than Discord's 3 second reply window.
+async def station_autocomplete(interaction, current):
+    matches = catalog.search(current, limit=25) if current else list(catalog)[:25]
+    return [app_commands.Choice(name=f"{s.name} - {s.title}"[:100] if s.title else s.name, value=s.name) for s in matches]
+
+@app_commands.command(name='play', description='Play a radio station')
+@app_commands.describe(station='Station name, or start typing to search')
+@app_commands.autocomplete(station=station_autocomplete)
+@app_commands.guild_only()
+async def slash_play(interaction: discord.Interaction, station: str):
+    await interaction.response.defer(thinking=True)
+
+    async def report(message):
+        await interaction.edit_original_response(content=message)
+
+    await play_station(players.get(interaction.guild_id), interaction.user, station, report, interaction.channel_id)
+
+@app_commands.command(name='stop', description='Stop the current radio stream')
+@app_commands.guild_only()
+async def slash_stop(interaction: discord.Interaction):
+    await interaction.response.send_message(stop_station(players.get(interaction.guild_id), interaction.user))
+
+@app_commands.command(name='volume', description='Change volume, or show it when no level is given')
+@app_commands.describe(level='Volume from 0 to 100')
+@app_commands.guild_only()
+async def slash_volume(interaction: discord.Interaction, level: app_commands.Range[int, 0, 100] = None):
+    player = players.get(interaction.guild_id)
+    if level is None:
+        await interaction.response.send_message(await set_volume(player, interaction.user, None), ephemeral=True)
+        return
+    # Switching between the Opus and PCM paths restarts the stream, so acknowledge first
+    await interaction.response.defer()
+    await interaction.edit_original_response(content=await set_volume(player, interaction.user, level))
+
+@app_commands.command(name='stations', description='List radio stations')
+@app_commands.describe(search="Filter by name, or 'all' to include offline stations")
+async def slash_stations(interaction: discord.Interaction, search: str = None):
+    await interaction.response.send_message(embed=stations_embed(search), ephemeral=True)
+
+@app_commands.command(name='status', description='Show bot configuration status')
+@app_commands.guild_only()
+async def slash_status(interaction: discord.Interaction):
+    await interaction.response.send_message(embed=status_embed(players.get(interaction.guild_id)), ephemeral=True)
+
+if SLASH_COMMANDS:
+    for slash_command in (slash_play, slash_stop, slash_volume, slash_stations, slash_status):
+        bot.tree.add_command(slash_command)
 
 # Run the bot
 if __name__ == "__main__":
@@ -481,7 +3036,7 @@ if __name__ == "__main__":
     print("3. Replace 'YOUR_BOT_TOKEN' with your actual bot token")
     print("4. Create a bot at https://discord.com/developers/applications")
     print("5. Add the bot to your server with appropriate permissions")
-    print("6. OPTIONAL: Set TARGET_GUILD_ID and TARGET_CHANNEL_ID for single-channel mode")
+    print("6. OPTIONAL: Set TARGET_GUILD_ID and TARGET_CHANNEL_ID to pre-designate a channel in one server")
     print("   Or use !setchannel command after bot starts (requires admin permissions)")
     print()
     print("Single-Channel Mode Features:")